@@ -27,6 +27,8 @@ def bench(name: str, fn, *args, **kwargs):
 if __name__ == "__main__":
     print("=== Benchmark Crawlers ===\n")
 
+    from database import init_db
+    init_db()
     from crawler import fetch_recent_papers
     from community_crawler import fetch_and_store_posts
     from code_crawler import fetch_and_store_code_posts
@@ -1,7 +1,11 @@
 """Database cleanup by retention. Papers 1y, code 1y, community/company 3mo."""
+import os
+import time
 from datetime import datetime, timedelta, timezone
+from typing import Sequence
 
-from database import get_connection
+from database import connection, full_vacuum
+from http_cache import forget_sources
 
 PAPERS_RETENTION_DAYS = 365
 POSTS_CODE_RETENTION_DAYS = 365  # github, huggingface
@@ -10,55 +14,73 @@ POSTS_COMMUNITY_RETENTION_DAYS = 90  # hn, reddit, youtube, company
 CODE_SOURCES = ("github", "huggingface")
 COMMUNITY_SOURCES = ("hn", "reddit", "youtube", "company")
 
+# 分批删除：每批单独提交并短暂让出写锁，清理期间 API 读写与入库不被长时间阻塞
+CLEANUP_CHUNK_SIZE = max(1, int(os.getenv("CLEANUP_CHUNK_SIZE", "500")))
+CLEANUP_PAUSE_SECONDS = 0.01
+# 每次 vacuum 最多回收的页数（默认页大小 4KiB 时约 64MB），每步回收 VACUUM_STEP_PAGES 页
+VACUUM_MAX_PAGES = int(os.getenv("VACUUM_MAX_PAGES", "16384"))
+VACUUM_STEP_PAGES = 1024
 
-def _cutoff_date(days: int) -> str:
-    return (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
 
+def _cutoff_ts(days: int) -> int:
+    """UTC epoch of midnight days ago (compared with published_ts / created_ts)."""
+    day = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return int((day - timedelta(days=days)).timestamp())
 
-def cleanup_papers_by_age(keep_days: int = PAPERS_RETENTION_DAYS) -> int:
-    """Delete papers older than keep_days. Also deletes related notifications. Returns count deleted."""
-    cutoff = _cutoff_date(keep_days)
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id FROM papers WHERE published_at IS NOT NULL AND published_at != '' AND published_at < ?",
-        (cutoff,),
-    )
-    ids = [r["id"] for r in cursor.fetchall()]
+
+def delete_rows(table: str, where: str, params: Sequence = (), chunk_size: int = CLEANUP_CHUNK_SIZE) -> int:
+    """Delete rows of papers/posts matching where, chunk_size at a time in rowid order, committing after each
+    chunk. Deleting papers also deletes their notifications, and the conditional-request cache entries of the
+    deleted rows' sources are dropped so their listings are fetched again. Returns count deleted."""
     deleted = 0
-    for pid in ids:
-        cursor.execute("DELETE FROM notifications WHERE paper_id = ?", (pid,))
-        cursor.execute("DELETE FROM papers WHERE id = ?", (pid,))
-        deleted += 1
-    conn.commit()
-    conn.close()
+    last = 0
+    sources = set()
+    while True:
+        with connection() as conn:
+            rows = conn.execute(
+                f"SELECT rowid, id, source FROM {table} WHERE rowid > ? AND ({where}) ORDER BY rowid LIMIT ?",
+                (last, *params, chunk_size),
+            ).fetchall()
+            if not rows:
+                break
+            ids = [r["id"] for r in rows]
+            placeholders = ",".join("?" * len(ids))
+            if table == "papers":
+                conn.execute(f"DELETE FROM notifications WHERE paper_id IN ({placeholders})", ids)
+            conn.execute(f"DELETE FROM {table} WHERE id IN ({placeholders})", ids)
+        deleted += len(rows)
+        sources.update(r["source"] for r in rows)
+        last = rows[-1]["rowid"]
+        if len(rows) < chunk_size:
+            break
+        time.sleep(CLEANUP_PAUSE_SECONDS)
+    if sources:
+        forget_sources(sources)
     return deleted
 
 
+def cleanup_papers_by_age(keep_days: int = PAPERS_RETENTION_DAYS) -> int:
+    """Delete papers older than keep_days. Also deletes related notifications. Returns count deleted."""
+    return delete_rows("papers", "published_ts < ?", (_cutoff_ts(keep_days),))
+
+
 def cleanup_posts_by_age(
     code_keep_days: int = POSTS_CODE_RETENTION_DAYS,
     community_keep_days: int = POSTS_COMMUNITY_RETENTION_DAYS,
 ) -> tuple[int, int]:
     """Delete posts older than retention. Code (github/huggingface) 1y, community/company 3mo.
     Returns (code_deleted, community_deleted)."""
-    code_cutoff = _cutoff_date(code_keep_days)
-    community_cutoff = _cutoff_date(community_keep_days)
-    conn = get_connection()
-    cursor = conn.cursor()
-    placeholders = ",".join("?" * len(CODE_SOURCES))
-    cursor.execute(
-        f"DELETE FROM posts WHERE source IN ({placeholders}) AND created_at IS NOT NULL AND created_at != '' AND created_at < ?",
-        (*CODE_SOURCES, code_cutoff),
+    where = "source IN ({}) AND created_ts < ?"
+    code_deleted = delete_rows(
+        "posts",
+        where.format(",".join("?" * len(CODE_SOURCES))),
+        (*CODE_SOURCES, _cutoff_ts(code_keep_days)),
     )
-    code_deleted = cursor.rowcount
-    placeholders = ",".join("?" * len(COMMUNITY_SOURCES))
-    cursor.execute(
-        f"DELETE FROM posts WHERE source IN ({placeholders}) AND created_at IS NOT NULL AND created_at != '' AND created_at < ?",
-        (*COMMUNITY_SOURCES, community_cutoff),
+    community_deleted = delete_rows(
+        "posts",
+        where.format(",".join("?" * len(COMMUNITY_SOURCES))),
+        (*COMMUNITY_SOURCES, _cutoff_ts(community_keep_days)),
     )
-    community_deleted = cursor.rowcount
-    conn.commit()
-    conn.close()
     return (code_deleted, community_deleted)
 
 
@@ -79,10 +101,28 @@ def run_cleanup(
     }
 
 
-def run_vacuum() -> None:
-    """Reclaim disk space after deletes. VACUUM requires autocommit."""
-    conn = get_connection()
-    conn.isolation_level = None
-    conn.execute("VACUUM")
-    conn.isolation_level = ""
-    conn.close()
+def run_vacuum(max_pages: int = VACUUM_MAX_PAGES) -> dict:
+    """Return free pages to the OS with bounded incremental_vacuum steps (auto_vacuum=INCREMENTAL), pausing
+    between steps so writers are not blocked. A database created before the switch is converted here once with
+    a full VACUUM (rewrites the file; needs about its size in free disk). Returns {"pages_freed", "pages_left"}."""
+    with connection() as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            print("[cleanup] Converting to auto_vacuum=INCREMENTAL (one-time full VACUUM)")
+            conn.isolation_level = None
+            try:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                full_vacuum(conn)
+            finally:
+                conn.isolation_level = ""
+            return {"pages_freed": free, "pages_left": 0}
+        freed = 0
+        while freed < max_pages:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            step = min(VACUUM_STEP_PAGES, free, max_pages - freed)
+            if step <= 0:
+                break
+            conn.execute(f"PRAGMA incremental_vacuum({step})").fetchall()
+            freed += step
+            time.sleep(CLEANUP_PAUSE_SECONDS)
+        return {"pages_freed": freed, "pages_left": conn.execute("PRAGMA freelist_count").fetchone()[0]}
@@ -1,17 +1,26 @@
 """Code crawler: GitHub, Hugging Face."""
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from datetime import datetime, timedelta
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
-import requests
-from database import get_connection, init_db, load_crawl_keywords
-from tagging import tag_post, tags_to_str, PAPER_TAG_KEYWORDS, POST_TAG_KEYWORDS, THREEDGS_REQUIRED_TAGS, SEARCH_WITHOUT_3DGS_PREFIX
+from database import connection, load_crawl_keywords, load_tag_memo, load_valid_tag_versions
+from crawl_engine import run_jobs
+from http_client import http_get
+from ingest import clean_post_text, write_records
+from tagging import tag_post, tag_input_hash, tag_rules_version, tags_to_str, POST_TAG_FIELDS, PAPER_TAG_KEYWORDS, POST_TAG_KEYWORDS, THREEDGS_REQUIRED_TAGS, SEARCH_WITHOUT_3DGS_PREFIX
 from crawler import ARXIV_SEARCH_KEYWORDS
+from company_crawler import COMPANY_DIRECTIONS
 
 GITHUB_API = "https://api.github.com/search/repositories"
 HF_API = "https://huggingface.co/api/models"
 
 CODE_PER_KEYWORD = min(30, max(10, int(os.getenv("CODE_PER_KEYWORD", "20"))))
+# 可选：GitHub 令牌，搜索配额由未认证 10 次/分钟提高到 30 次/分钟（rate_limit 按是否设置选择速率）
+GITHUB_TOKEN = os.getenv("GITHUB_TOKEN", "").strip()
+# GitHub 搜索：一条 q 最多 5 个 OR（6 个关键词）、256 个字符；每次刷新的搜索数不超过一分钟的配额
+GITHUB_OR_TERMS = 6
+GITHUB_QUERY_MAX_LEN = 256
+GITHUB_MAX_QUERIES = 30 if GITHUB_TOKEN else 10
 
 
 def _parse_date(s: str | None) -> datetime | None:
@@ -25,16 +34,40 @@ def _parse_date(s: str | None) -> datetime | None:
         return None
 
 
-def _fetch_github(query: str, max_results: int = 15, created_since: str | None = None) -> list[dict]:
-    """Fetch from GitHub search (repos). created_since: YYYY-MM-DD for created:>= filter."""
+def _github_queries(keywords: list[str], created_since: str | None = None) -> list[tuple[str, int]]:
+    """OR keywords into GitHub search q strings within the operator and length limits, at most GITHUB_MAX_QUERIES.
+    Returns (q, number of keywords in q) pairs."""
+    qualifier = f" created:>={created_since}" if created_since else ""
+    budget = GITHUB_QUERY_MAX_LEN - len(qualifier)
+    queries, terms = [], []
+    for kw in keywords:
+        kw = kw.replace('"', " ").strip()
+        if not kw:
+            continue
+        term = f'"{kw}"' if " " in kw else kw
+        if terms and (len(terms) >= GITHUB_OR_TERMS or len(" OR ".join(terms + [term])) > budget):
+            queries.append(terms)
+            terms = []
+        terms.append(term)
+    if terms:
+        queries.append(terms)
+    if len(queries) > GITHUB_MAX_QUERIES:
+        print(f"[code] GitHub: {len(keywords)} keywords need {len(queries)} searches, only the first {GITHUB_MAX_QUERIES} are run")
+        queries = queries[:GITHUB_MAX_QUERIES]
+    return [(" OR ".join(t) + qualifier, len(t)) for t in queries]
+
+
+def _fetch_github(q: str, max_results: int = 15) -> list[dict]:
+    """Fetch from GitHub search (repos). q: search string including any created:>= qualifier."""
     posts = []
-    q = f"{query} created:>={created_since}" if created_since else query
+    headers = {"Accept": "application/vnd.github.v3+json"}
+    if GITHUB_TOKEN:
+        headers["Authorization"] = f"Bearer {GITHUB_TOKEN}"
     try:
-        r = requests.get(
+        r = http_get(
             GITHUB_API,
             params={"q": q, "sort": "created", "per_page": max_results},
-            headers={"Accept": "application/vnd.github.v3+json", "User-Agent": "ResearchTracker"},
-            timeout=15,
+            headers=headers,
         )
         r.raise_for_status()
         data = r.json()
@@ -65,15 +98,13 @@ def _fetch_huggingface(query: str, max_results: int = 15, cutoff_dt: datetime |
     limit = min(max(max_results, 50), 50) if cutoff_dt else min(max_results, 50)
     sort = "created" if cutoff_dt else "downloads"
     try:
-        r = requests.get(
+        r = http_get(
             HF_API,
             params={
                 "search": query,
                 "limit": limit,
                 "sort": sort,
             },
-            timeout=20,
-            headers={"User-Agent": "ResearchTracker/1.0"},
         )
         r.raise_for_status()
         data = r.json()
@@ -126,7 +157,6 @@ def fetch_and_store_code_posts(days: int | None = None, tag: str | None = None)
     days: only fetch items created in last N days (30/90). None = no filter (all).
     tag: when set, only use keywords for this tag (from PAPER_TAG_KEYWORDS). Enables 选定标签->选定时间 抓取.
     """
-    init_db()
     all_posts = []
     seen_ids = set()
     seen_urls = set()
@@ -147,7 +177,7 @@ def fetch_and_store_code_posts(days: int | None = None, tag: str | None = None)
         seen_ids.add(p["id"])
         if norm_url:
             seen_urls.add(norm_url)
-        all_posts.append(p)
+        all_posts.append(clean_post_text(p))
 
     # 选定标签：用论文关键词抓取（更全，与论文抓取一致）
     if tag and tag.strip() and tag.strip() in PAPER_TAG_KEYWORDS:
@@ -164,48 +194,37 @@ def fetch_and_store_code_posts(days: int | None = None, tag: str | None = None)
 
     kw_lower = [k.lower() for k in keywords]
 
-    def _fetch_github_batch():
-        out = []
-        for kw in kw_lower:
-            out.extend(_fetch_github(kw, max_results=CODE_PER_KEYWORD, created_since=created_since))
-        return out
-
-    def _fetch_hf_batch():
-        out = []
-        for kw in kw_lower:
-            out.extend(_fetch_huggingface(kw, max_results=CODE_PER_KEYWORD, cutoff_dt=cutoff_dt))
-        return out
-
-    with ThreadPoolExecutor(max_workers=2) as ex:
-        fut_gh = ex.submit(_fetch_github_batch)
-        fut_hf = ex.submit(_fetch_hf_batch)
-        for batch in [fut_gh.result(), fut_hf.result()]:
-            for p in batch:
-                _add_post(p)
-
-    conn = get_connection()
-    cursor = conn.cursor()
-    inserted = 0
+    # GitHub 搜索配额很低：关键词按 OR 合并成少量查询，每个查询的条数按所含关键词数放大；Hugging Face 每个关键词
+    # 一个查询。由抓取引擎按主机限流并发执行，结果按提交顺序合并（GitHub 在前）
+    jobs = [
+        (GITHUB_API, _fetch_github, (q, min(100, CODE_PER_KEYWORD * n)))
+        for q, n in _github_queries(kw_lower, created_since)
+    ]
+    jobs += [(HF_API, partial(_fetch_huggingface, max_results=CODE_PER_KEYWORD, cutoff_dt=cutoff_dt), (kw,)) for kw in kw_lower]
+    for posts in run_jobs(jobs):
+        for p in posts:
+            _add_post(p)
+
+    rules_version = tag_rules_version("posts", COMPANY_DIRECTIONS)
+    with connection() as conn:
+        cursor = conn.cursor()
+        valid_versions = load_valid_tag_versions(cursor, "posts", rules_version)
+        memo = load_tag_memo(cursor, "posts", [p["id"] for p in all_posts])
+    records = []
     for p in all_posts:
-        try:
+        tag_hash = tag_input_hash(p.get(f) for f in POST_TAG_FIELDS)
+        cached = memo.get(p["id"])
+        if cached is not None and cached["tag_hash"] == tag_hash and cached["tag_version"] in valid_versions:
+            tags = cached["tags"] or ""  # 内容与规则均未变，复用已有标签
+        else:
             tags = tags_to_str(tag_post(
                 p.get("title", ""),
                 p.get("summary", ""),
                 p.get("source", ""),
                 p.get("channel"),
             ))
-            cursor.execute("""
-                INSERT OR REPLACE INTO posts
-                (id, source, title, url, author, score, comment_count, summary, channel, tags, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                p["id"], p["source"], p["title"], p["url"], p["author"],
-                p["score"], p["comment_count"], p["summary"], p["channel"],
-                tags, p["created_at"],
-            ))
-            inserted += 1
-        except Exception as e:
-            print(f"Error inserting post {p['id']}: {e}")
-    conn.commit()
-    conn.close()
+        records.append({**p, "tags": tags, "tag_hash": tag_hash, "tag_version": rules_version})
+    inserted, db_errors = write_records("posts", records)
+    for e in db_errors:
+        print(f"Error inserting post {e}")
     return inserted
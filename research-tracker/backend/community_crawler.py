@@ -1,6 +1,7 @@
 """Community crawler: Hacker News, Reddit, YouTube."""
+import json
 import os
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
 from pathlib import Path
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
 
@@ -8,9 +9,15 @@ from dotenv import load_dotenv
 load_dotenv(Path(__file__).resolve().parent / ".env")
 import requests
 from datetime import datetime, timedelta
-from database import get_connection, init_db, load_crawl_keywords
-from tagging import tag_post, tags_to_str, PAPER_TAG_KEYWORDS, POST_TAG_KEYWORDS, THREEDGS_REQUIRED_TAGS, SEARCH_WITHOUT_3DGS_PREFIX
+from crawl_engine import run_jobs
+from http_cache import get_if_changed, remember
+from http_client import http_get
+from database import connection, load_crawl_keywords, load_tag_memo, load_valid_tag_versions
+from retag import mark_tag_rules_applied, retag_table, sync_tag_rules
+from ingest import clean_post_text, write_records
+from tagging import tag_post, tag_posts_batch, tag_input_hash, tag_rules_snapshot, tag_rules_version, tags_to_str, POST_TAG_FIELDS, PAPER_TAG_KEYWORDS, POST_TAG_KEYWORDS, THREEDGS_REQUIRED_TAGS, SEARCH_WITHOUT_3DGS_PREFIX
 from crawler import ARXIV_SEARCH_KEYWORDS
+from company_crawler import COMPANY_DIRECTIONS
 
 HN_API = "https://hn.algolia.com/api/v1/search"
 REDDIT_BASE = "https://www.reddit.com"
@@ -21,14 +28,6 @@ REDDIT_SUBS = ["MachineLearning", "computervision", "LocalLLaMA"]
 COMMUNITY_PER_KEYWORD = min(20, max(10, int(os.getenv("COMMUNITY_PER_KEYWORD", "15"))))
 
 
-def _get_proxies() -> dict | None:
-    """Get proxies from env for requests (Reddit/YouTube 等需代理时使用)."""
-    proxy = os.environ.get("HTTPS_PROXY") or os.environ.get("HTTP_PROXY")
-    if proxy and proxy.strip():
-        return {"http": proxy.strip(), "https": proxy.strip()}
-    return None
-
-
 def _fetch_hn(query: str, max_results: int = 20, created_after_ts: int | None = None) -> list[dict]:
     """Fetch from Hacker News via Algolia API. created_after_ts: only items created after this unix timestamp."""
     posts = []
@@ -40,13 +39,7 @@ def _fetch_hn(query: str, max_results: int = 20, created_after_ts: int | None =
     if created_after_ts is not None:
         params["numericFilters"] = [f"created_at_i>{created_after_ts}"]
     try:
-        r = requests.get(
-            HN_API,
-            params=params,
-            timeout=20,
-            headers={"User-Agent": "ResearchTracker/1.0"},
-            proxies=_get_proxies(),
-        )
+        r = http_get(HN_API, params=params)
         r.raise_for_status()
         data = r.json()
         for hit in data.get("hits", []):
@@ -70,20 +63,25 @@ def _fetch_hn(query: str, max_results: int = 20, created_after_ts: int | None =
     return posts
 
 
-def _fetch_reddit(sub: str, limit: int = 15, cutoff_ts: float | None = None, errors: list | None = None) -> list[dict]:
-    """Fetch from Reddit (public JSON, no auth). cutoff_ts: only items created after this unix timestamp."""
+def _fetch_reddit(
+    sub: str,
+    limit: int = 15,
+    cutoff_ts: float | None = None,
+    errors: list | None = None,
+    cache_scope: str = "",
+    cache_pending: list | None = None,
+) -> list[dict]:
+    """Fetch from Reddit (public JSON, no auth). cutoff_ts: only items created after this unix timestamp.
+    A listing unchanged since the last fetch under cache_scope returns no posts (its items are already stored);
+    a parsed changed listing's cache entry goes to cache_pending, written by the caller after storing."""
     posts = []
-    proxies = _get_proxies()
+    fresh = []
     try:
-        r = requests.get(
-            f"{REDDIT_BASE}/r/{sub}/new.json",
-            params={"limit": limit},
-            headers={"User-Agent": "ResearchTracker/1.0"},
-            timeout=15,
-            proxies=proxies,
-        )
+        r, changed, body = get_if_changed(f"{REDDIT_BASE}/r/{sub}/new.json", params={"limit": limit}, scope=cache_scope, pending=fresh)
+        if not changed:
+            return posts
         r.raise_for_status()
-        data = r.json()
+        data = json.loads(body)
         for child in data.get("data", {}).get("children", []):
             d = child.get("data", {})
             post_id = d.get("id")
@@ -104,6 +102,8 @@ def _fetch_reddit(sub: str, limit: int = 15, cutoff_ts: float | None = None, err
                 "channel": f"r/{sub}",
                 "created_at": datetime.fromtimestamp(created).isoformat() if created else None,
             })
+        if cache_pending is not None:
+            cache_pending.extend(fresh)
     except Exception as e:
         err_msg = f"Reddit r/{sub}: {e}"
         print(f"Reddit r/{sub} fetch error: {e}")
@@ -121,9 +121,8 @@ def _fetch_youtube(query: str, max_results: int = 15, cutoff_dt: datetime | None
             errors.append("YouTube: YOUTUBE_API_KEY 未设置")
         return posts
     try:
-        r = requests.get(
+        r = http_get(
             YOUTUBE_API,
-            proxies=_get_proxies(),
             params={
                 "part": "snippet",
                 "q": query,
@@ -132,8 +131,6 @@ def _fetch_youtube(query: str, max_results: int = 15, cutoff_dt: datetime | None
                 "order": "date",
                 "key": api_key,
             },
-            timeout=20,
-            headers={"User-Agent": "ResearchTracker/1.0"},
         )
         r.raise_for_status()
         data = r.json()
@@ -210,7 +207,6 @@ def fetch_and_store_posts(
     source: when set (hn/reddit/youtube), only fetch from that platform.
     Returns (inserted_count, list of error messages).
     """
-    init_db()
     all_posts = []
     seen_ids = set()
     seen_urls = set()
@@ -228,7 +224,7 @@ def fetch_and_store_posts(
         seen_ids.add(p["id"])
         if norm_url:
             seen_urls.add(norm_url)
-        all_posts.append(p)
+        all_posts.append(clean_post_text(p))
 
     # 选定标签：用论文关键词抓取（更全，与论文抓取一致）；Reddit 无关键词搜索，按标签时跳过
     if tag and tag.strip() and tag.strip() in PAPER_TAG_KEYWORDS:
@@ -248,64 +244,79 @@ def fetch_and_store_posts(
     fetch_reddit = (not src or src == "reddit") and (not tag or not tag.strip() or tag.strip() not in PAPER_TAG_KEYWORDS)
     fetch_youtube = not src or src == "youtube"
 
-    def _fetch_hn_batch():
-        out = []
-        if fetch_hn:
-            for kw in keywords:
-                out.extend(_fetch_hn(kw, max_results=COMMUNITY_PER_KEYWORD, created_after_ts=cutoff_ts))
-        return out
-
-    def _fetch_reddit_batch():
-        out = []
-        if fetch_reddit:
-            for sub in REDDIT_SUBS:
-                out.extend(_fetch_reddit(sub, limit=COMMUNITY_PER_KEYWORD, cutoff_ts=cutoff_ts, errors=errors))
-        return out
-
-    def _fetch_youtube_batch():
-        out = []
-        if fetch_youtube:
-            for kw in keywords:
-                out.extend(_fetch_youtube(kw, max_results=COMMUNITY_PER_KEYWORD, cutoff_dt=cutoff, errors=errors))
-        return out
-
-    tasks = []
+    # 每个关键词 / 子版块一个查询，由抓取引擎按主机限流并发执行；结果按提交顺序合并
+    jobs = []
+    cache_pending: list = []
     if fetch_hn:
-        tasks.append(_fetch_hn_batch)
+        jobs += [(HN_API, partial(_fetch_hn, max_results=COMMUNITY_PER_KEYWORD, created_after_ts=cutoff_ts), (kw,)) for kw in keywords]
     if fetch_reddit:
-        tasks.append(_fetch_reddit_batch)
+        # 与上次抓取（同一时间窗口）相比未变化的子版块列表不再解析和打标
+        fetch_reddit_sub = partial(
+            _fetch_reddit,
+            limit=COMMUNITY_PER_KEYWORD,
+            cutoff_ts=cutoff_ts,
+            errors=errors,
+            cache_scope=f"reddit:{days}",
+            cache_pending=cache_pending,
+        )
+        jobs += [(REDDIT_BASE, fetch_reddit_sub, (sub,)) for sub in REDDIT_SUBS]
     if fetch_youtube:
-        tasks.append(_fetch_youtube_batch)
-
-    with ThreadPoolExecutor(max_workers=min(3, len(tasks) or 1)) as ex:
-        futures = [ex.submit(fn) for fn in tasks]
-        for fut in as_completed(futures):
-            for p in fut.result():
-                _add_post(p)
+        jobs += [(YOUTUBE_API, partial(_fetch_youtube, max_results=COMMUNITY_PER_KEYWORD, cutoff_dt=cutoff, errors=errors), (kw,)) for kw in keywords]
+    for posts in run_jobs(jobs):
+        for p in posts:
+            _add_post(p)
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    inserted = 0
+    rules_version = tag_rules_version("posts", COMPANY_DIRECTIONS)
+    with connection() as conn:
+        cursor = conn.cursor()
+        valid_versions = load_valid_tag_versions(cursor, "posts", rules_version)
+        memo = load_tag_memo(cursor, "posts", [p["id"] for p in all_posts])
+    records = []
     for p in all_posts:
-        try:
+        tag_hash = tag_input_hash(p.get(f) for f in POST_TAG_FIELDS)
+        cached = memo.get(p["id"])
+        if cached is not None and cached["tag_hash"] == tag_hash and cached["tag_version"] in valid_versions:
+            tags = cached["tags"] or ""  # 内容与规则均未变，复用已有标签
+        else:
             tags = tags_to_str(tag_post(
                 p.get("title", ""),
                 p.get("summary", ""),
                 p.get("source", ""),
                 p.get("channel"),
             ))
-            cursor.execute("""
-                INSERT OR REPLACE INTO posts
-                (id, source, title, url, author, score, comment_count, summary, channel, tags, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                p["id"], p["source"], p["title"], p["url"], p["author"],
-                p["score"], p["comment_count"], p["summary"], p["channel"],
-                tags, p["created_at"],
-            ))
-            inserted += 1
-        except Exception as e:
-            print(f"Error inserting post {p['id']}: {e}")
-    conn.commit()
-    conn.close()
+        records.append({**p, "tags": tags, "tag_hash": tag_hash, "tag_version": rules_version})
+    inserted, db_errors = write_records("posts", records)
+    for e in db_errors:
+        print(f"Error inserting post {e}")
+    if not db_errors:
+        remember(cache_pending)  # 入库成功后才记下订阅源的校验值，失败时下次重新处理
     return inserted, errors
+
+
+def backfill_post_tags(force: bool = False, workers: int | None = None) -> int:
+    """Backfill tags for community/code/company posts. If force=False, only posts with NULL/empty tags.
+    Returns count updated."""
+    version = tag_rules_version("posts", COMPANY_DIRECTIONS)
+    n = retag_table(
+        "posts",
+        POST_TAG_FIELDS,
+        partial(tag_posts_batch, company_directions=COMPANY_DIRECTIONS),
+        version,
+        force=force,
+        workers=workers,
+    )
+    if force:
+        mark_tag_rules_applied("posts", version, tag_rules_snapshot("posts", COMPANY_DIRECTIONS))
+    return n
+
+
+def sync_post_tag_rules(allow_full: bool = False) -> dict:
+    """Re-tag posts affected by keyword-table edits since the last applied rule set (see retag.sync_tag_rules)."""
+    return sync_tag_rules(
+        "posts",
+        POST_TAG_FIELDS,
+        partial(tag_posts_batch, company_directions=COMPANY_DIRECTIONS),
+        tag_rules_snapshot("posts", COMPANY_DIRECTIONS),
+        tag_rules_version("posts", COMPANY_DIRECTIONS),
+        allow_full=allow_full,
+    )
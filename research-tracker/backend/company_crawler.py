@@ -3,30 +3,19 @@ import os
 import re
 import urllib.parse
 from urllib.parse import urlparse, urlunparse, parse_qs, urlencode
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import html
+from functools import partial
 import feedparser
-import requests
 from datetime import datetime, timezone, timedelta
 
-# 每家公司抓取条数（减少请求量）
+# 每家公司抓取条数（减少请求量）；Google News 初始并发数见 crawl_engine.HOST_CONCURRENCY（COMPANY_FETCH_WORKERS）
 COMPANY_MAX_RESULTS = int(os.getenv("COMPANY_FETCH_MAX_RESULTS", "5"))
-# 并行抓取线程数
-COMPANY_FETCH_WORKERS = int(os.getenv("COMPANY_FETCH_WORKERS", "6"))
 
 
-def _strip_html(text: str) -> str:
-    """Remove HTML tags and decode entities. Handles Google News RSS HTML format."""
-    if not text:
-        return ""
-    # 先 unescape，再移除所有 HTML 标签（包括多行、属性含引号等）
-    text = html.unescape(text)
-    text = re.sub(r"<[^>]+>", "", text, flags=re.DOTALL)
-    return re.sub(r"\s+", " ", text).strip()
-
-
-from database import get_connection, init_db, load_crawl_keywords
-from tagging import tag_company_post, tags_to_str
+from database import connection, load_crawl_keywords, load_tag_memo, load_valid_tag_versions
+from crawl_engine import run_jobs
+from http_cache import get_if_changed, remember
+from ingest import clean_post_text, strip_html, write_records
+from tagging import tag_company_post, tag_input_hash, tag_rules_version, tags_to_str, POST_TAG_FIELDS
 
 # 方向 -> 公司列表（每方向约5家）
 COMPANY_DIRECTIONS = {
@@ -77,26 +66,29 @@ WECHAT_MP_ALBUMS: dict[str, tuple[str, str]] = {
 RSSHUB_BASE = os.getenv("RSSHUB_BASE_URL", "https://rsshub.app")
 
 
-def _get_requests_session():
-    """Session that respects HTTP_PROXY/HTTPS_PROXY for Google News access."""
-    s = requests.Session()
-    s.headers.update({"User-Agent": "ResearchTracker/1.0"})
-    return s
-
-
-def _fetch_company_news(company: str, max_results: int = 10, cutoff_dt: datetime | None = None) -> tuple[list[dict], str | None]:
-    """Fetch company news from Google News RSS. Returns (posts, error_msg). cutoff_dt: only items published after this."""
+def _fetch_company_news(
+    company: str,
+    max_results: int = 10,
+    cutoff_dt: datetime | None = None,
+    cache_scope: str = "",
+    cache_pending: list | None = None,
+) -> tuple[list[dict], str | None]:
+    """Fetch company news from Google News RSS. Returns (posts, error_msg). cutoff_dt: only items published after this.
+    A feed unchanged since the last fetch under cache_scope returns no posts (its items are already stored);
+    a parsed changed feed's cache entry goes to cache_pending, written by the caller after storing."""
     posts = []
+    fresh = []
     query = COMPANY_QUERIES.get(company, company)
     try:
         q_enc = urllib.parse.quote(query)
         url = f"{GOOGLE_NEWS_RSS}?q={q_enc}&hl=zh-CN&gl=CN&ceid=CN:zh-Hans"
         if not any(ord(c) > 127 for c in query):
             url = f"{GOOGLE_NEWS_RSS}?q={q_enc}&hl=en&gl=US&ceid=US:en"
-        session = _get_requests_session()
-        r = session.get(url, timeout=15)
+        r, changed, body = get_if_changed(url, scope=cache_scope, pending=fresh)
+        if not changed:
+            return (posts, None)
         r.raise_for_status()
-        feed = feedparser.parse(r.content)
+        feed = feedparser.parse(body)
         count = 0
         for i, entry in enumerate(feed.get("entries", [])):
             if count >= max_results:
@@ -110,7 +102,7 @@ def _fetch_company_news(company: str, max_results: int = 10, cutoff_dt: datetime
                 except (TypeError, ValueError):
                     pass
             link = entry.get("link") or ""
-            title = _strip_html(entry.get("title") or "") or "(no title)"
+            title = strip_html(entry.get("title") or "") or "(no title)"
             published = entry.get("published_parsed")
             created_at = None
             if published:
@@ -125,30 +117,44 @@ def _fetch_company_news(company: str, max_results: int = 10, cutoff_dt: datetime
                 "source": "company",
                 "title": title,
                 "url": link,
-                "author": _strip_html((entry.get("source") or {}).get("title", "") or ""),
+                "author": strip_html((entry.get("source") or {}).get("title", "") or ""),
                 "score": 0,
                 "comment_count": 0,
-                "summary": _strip_html(entry.get("summary", "") or "")[:500],
+                "summary": strip_html(entry.get("summary", "") or "")[:500],
                 "channel": company,
                 "created_at": created_at,
             })
             count += 1
+        if cache_pending is not None:
+            cache_pending.extend(fresh)
         return (posts, None)
     except Exception as e:
         err = f"{company}: {e}"
         return (posts, err)
 
 
-def _fetch_wechat_news(company: str, max_results: int = 5, cutoff_dt: datetime | None = None) -> list[dict]:
-    """Fetch WeChat official account articles via RSSHub. cutoff_dt: only items published after this."""
+def _fetch_wechat_news(
+    company: str,
+    max_results: int = 5,
+    cutoff_dt: datetime | None = None,
+    cache_scope: str = "",
+    cache_pending: list | None = None,
+) -> list[dict]:
+    """Fetch WeChat official account articles via RSSHub. cutoff_dt: only items published after this.
+    A feed unchanged since the last fetch under cache_scope returns no posts; see _fetch_company_news."""
     posts = []
+    fresh = []
     biz_aid = WECHAT_MP_ALBUMS.get(company)
     if not biz_aid:
         return posts
     biz, aid = biz_aid
     try:
         url = f"{RSSHUB_BASE}/wechat/mp/msgalbum/{biz}/{aid}"
-        feed = feedparser.parse(url, agent="ResearchTracker/1.0")
+        r, changed, body = get_if_changed(url, scope=cache_scope, pending=fresh)
+        if not changed:
+            return posts
+        r.raise_for_status()
+        feed = feedparser.parse(body)
         count = 0
         for i, entry in enumerate(feed.get("entries", [])):
             if count >= max_results:
@@ -162,7 +168,7 @@ def _fetch_wechat_news(company: str, max_results: int = 5, cutoff_dt: datetime |
                 except (TypeError, ValueError):
                     pass
             link = entry.get("link") or ""
-            title = _strip_html(entry.get("title") or "") or "(no title)"
+            title = strip_html(entry.get("title") or "") or "(no title)"
             published = entry.get("published_parsed")
             created_at = None
             if published:
@@ -180,11 +186,13 @@ def _fetch_wechat_news(company: str, max_results: int = 5, cutoff_dt: datetime |
                 "author": "微信公众号",
                 "score": 0,
                 "comment_count": 0,
-                "summary": _strip_html(entry.get("summary", "") or "")[:500],
+                "summary": strip_html(entry.get("summary", "") or "")[:500],
                 "channel": company,
                 "created_at": created_at,
             })
             count += 1
+        if cache_pending is not None:
+            cache_pending.extend(fresh)
     except Exception as e:
         print(f"WeChat {company} fetch error: {e}")
     return posts
@@ -210,7 +218,6 @@ def _normalize_url(url: str) -> str:
 
 def fetch_and_store_company_posts(days: int = 90) -> tuple[int, list[str]]:
     """Fetch company news and store in DB. Only items from last N days (default 90 = 3 months). Returns (inserted_count, errors)."""
-    init_db()
     all_posts = []
     errors: list[str] = []
     seen_ids = set()
@@ -230,44 +237,38 @@ def fetch_and_store_company_posts(days: int = 90) -> tuple[int, list[str]]:
         seen_ids.add(p["id"])
         if norm_url:
             seen_urls.add(norm_url)
-        all_posts.append(p)
-
-    def _fetch_one(company: str):
-        posts, err = _fetch_company_news(company, max_results=COMPANY_MAX_RESULTS, cutoff_dt=cutoff_dt)
-        return (company, posts, err)
+        all_posts.append(clean_post_text(p))
 
-    with ThreadPoolExecutor(max_workers=COMPANY_FETCH_WORKERS) as ex:
-        futures = {ex.submit(_fetch_one, c): c for c in companies}
-        for fut in as_completed(futures):
-            company, posts, err = fut.result()
-            if err:
-                errors.append(err)
-            for p in posts:
-                _add_post(p)
-
-    for company in companies:
-        for p in _fetch_wechat_news(company, max_results=5, cutoff_dt=cutoff_dt):
+    # 公司新闻、公众号、自定义关键词（作为额外 Google News 搜索）各为一个查询，由抓取引擎按主机限流并发执行；
+    # 结果按此顺序合并去重。与上次抓取（同一时间窗口）相比未变化的订阅源不再解析和打标
+    cache_scope = f"company:{days}"
+    cache_pending: list = []
+    fetch_news = partial(
+        _fetch_company_news, max_results=COMPANY_MAX_RESULTS, cutoff_dt=cutoff_dt, cache_scope=cache_scope, cache_pending=cache_pending
+    )
+    fetch_wechat = partial(_fetch_wechat_news, max_results=5, cutoff_dt=cutoff_dt, cache_scope=cache_scope, cache_pending=cache_pending)
+    jobs = [(GOOGLE_NEWS_RSS, fetch_news, (c,)) for c in companies]
+    jobs += [(RSSHUB_BASE, fetch_wechat, (c,)) for c in companies if c in WECHAT_MP_ALBUMS]
+    jobs += [(GOOGLE_NEWS_RSS, fetch_news, (kw,)) for kw in load_crawl_keywords("company")]
+    for (_, fn, _), result in zip(jobs, run_jobs(jobs)):
+        posts, err = result if fn is fetch_news else (result, None)
+        if err:
+            errors.append(err)
+        for p in posts:
             _add_post(p)
 
-    # 自定义关键词：作为额外 Google News 搜索
-    extra_kws = load_crawl_keywords("company")
-    if extra_kws:
-        def _fetch_kw(kw: str):
-            posts, err = _fetch_company_news(kw, max_results=COMPANY_MAX_RESULTS, cutoff_dt=cutoff_dt)
-            return (kw, posts, err)
-        with ThreadPoolExecutor(max_workers=COMPANY_FETCH_WORKERS) as ex:
-            futures = {ex.submit(_fetch_kw, kw): kw for kw in extra_kws}
-            for fut in as_completed(futures):
-                kw, posts, err = fut.result()
-                if err:
-                    errors.append(err)
-                for p in posts:
-                    _add_post(p)
-    conn = get_connection()
-    cursor = conn.cursor()
-    inserted = 0
+    rules_version = tag_rules_version("posts", COMPANY_DIRECTIONS)
+    with connection() as conn:
+        cursor = conn.cursor()
+        valid_versions = load_valid_tag_versions(cursor, "posts", rules_version)
+        memo = load_tag_memo(cursor, "posts", [p["id"] for p in all_posts])
+    records = []
     for p in all_posts:
-        try:
+        tag_hash = tag_input_hash(p.get(f) for f in POST_TAG_FIELDS)
+        cached = memo.get(p["id"])
+        if cached is not None and cached["tag_hash"] == tag_hash and cached["tag_version"] in valid_versions:
+            tags = cached["tags"] or ""  # 内容与规则均未变，复用已有标签
+        else:
             tags = tags_to_str(tag_company_post(
                 p.get("title", ""),
                 p.get("summary", ""),
@@ -275,18 +276,9 @@ def fetch_and_store_company_posts(days: int = 90) -> tuple[int, list[str]]:
                 p.get("author", ""),
                 COMPANY_DIRECTIONS,
             ))
-            cursor.execute("""
-                INSERT OR REPLACE INTO posts
-                (id, source, title, url, author, score, comment_count, summary, channel, tags, created_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                p["id"], p["source"], p["title"], p["url"], p["author"],
-                p["score"], p["comment_count"], p["summary"], p["channel"],
-                tags, p["created_at"],
-            ))
-            inserted += 1
-        except Exception as e:
-            errors.append(f"DB insert {p.get('id', '')}: {e}")
-    conn.commit()
-    conn.close()
+        records.append({**p, "tags": tags, "tag_hash": tag_hash, "tag_version": rules_version})
+    inserted, db_errors = write_records("posts", records)
+    errors.extend(f"DB insert {e}" for e in db_errors)
+    if not db_errors:
+        remember(cache_pending)  # 入库成功后才记下订阅源的校验值，失败时下次重新处理
     return (inserted, errors)
@@ -0,0 +1,203 @@
+"""Asyncio crawl engine: runs crawler fetch jobs concurrently, at most a per-host number at a time.
+
+A job is (url, fn, args): fn(*args) does upstream queries through http_client (blocking) and parses them.
+The event loop only schedules: each job waits for a slot of its url's host, then runs on the shared crawl
+thread pool, so queries to different hosts overlap and each host sees a bounded queue. Slots are counted per
+process, so crawl() runs of different sources (each on its own thread and event loop) share a host's limit.
+run_jobs is the sync entry point used by the fetch_and_store_* functions.
+
+Per-host limits are adaptive (AIMD): http_get reports every response to the host's HostConcurrency, which
+adds one slot per round of healthy responses and halves the limit on timeouts, connection errors, 429 and
+5xx."""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Sequence
+from urllib.parse import urlsplit
+
+# 每个主机的初始并发数；未列出的主机用 CRAWL_HOST_CONCURRENCY
+CRAWL_HOST_CONCURRENCY = max(1, int(os.getenv("CRAWL_HOST_CONCURRENCY", "4")))
+HOST_CONCURRENCY: dict[str, int] = {
+    "export.arxiv.org": 1,  # arXiv 要求串行、低频访问
+    "hn.algolia.com": 8,
+    "huggingface.co": 8,
+    "www.reddit.com": 2,
+    "news.google.com": max(1, int(os.getenv("COMPANY_FETCH_WORKERS", "6"))),
+}
+# 自适应调整的并发上限；未列出的主机用 CRAWL_MAX_CONCURRENCY
+CRAWL_MAX_CONCURRENCY = max(1, int(os.getenv("CRAWL_MAX_CONCURRENCY", "16")))
+HOST_MAX_CONCURRENCY: dict[str, int] = {
+    "export.arxiv.org": 1,
+}
+# 响应延迟超过基线的该倍数视为排队拥塞，不再增加并发
+LATENCY_TOLERANCE = 2.0
+# 执行阻塞请求的线程数（所有主机共享）
+CRAWL_THREADS = max(1, int(os.getenv("CRAWL_THREADS", "32")))
+
+Job = tuple[str, Callable, Sequence]
+
+_executor: ThreadPoolExecutor | None = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=CRAWL_THREADS, thread_name_prefix="crawl")
+        return _executor
+
+
+class HostConcurrency:
+    """AIMD concurrency limit of one host, fed by http_get from crawler threads."""
+
+    def __init__(self, host: str, initial: int, maximum: int):
+        self.host = host
+        self.maximum = maximum
+        self.limit = float(min(initial, maximum))
+        self.latency = None  # 健康响应延迟基线（秒）
+        self.cuts = 0
+        self.inflight = 0
+        self._last_cut = 0.0
+        self._waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+        self._lock = threading.Lock()
+
+    def slots(self) -> int:
+        return max(1, int(self.limit))
+
+    async def acquire(self) -> None:
+        """Wait until the host has a free slot and take it; waiters may be in different event loops."""
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.inflight < self.slots():
+                    self.inflight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            finally:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+
+    def release(self) -> None:
+        with self._lock:
+            self.inflight -= 1
+            self._wake()
+
+    def _wake(self) -> None:
+        # 调用方持有 _lock；唤醒全部等待者重新检查（上限可能同时变化），等待者各自所在的事件循环线程安全地唤醒
+        for loop, fut in self._waiters:
+            try:
+                loop.call_soon_threadsafe(_set_done, fut)
+            except RuntimeError:  # 事件循环已关闭
+                pass
+        self._waiters.clear()
+
+    def record(self, sent_at: float, status: int | None, paced: bool = False) -> None:
+        """Record a response (status None = timeout / connection error) to a request sent at sent_at
+        (time.monotonic). paced: the request waited for the host's rate limiter, so more slots would not help."""
+        latency = time.monotonic() - sent_at
+        with self._lock:
+            if status is None or status == 429 or status >= 500:
+                # 乘性减：每轮只减一次，早于上次减半发出的请求的失败不再重复计入
+                if sent_at >= self._last_cut:
+                    self.limit = max(1.0, self.limit / 2)
+                    self.cuts += 1
+                    self._last_cut = time.monotonic()
+                return
+            if status >= 400:
+                return
+            base = self.latency
+            # 基线取近期最低延迟，缓慢上浮以适应上游整体变慢
+            self.latency = latency if base is None or latency < base else base + (latency - base) * 0.05
+            if paced or (base is not None and latency > base * LATENCY_TOLERANCE):
+                return
+            # 加性增：每轮（约 limit 个健康响应）加 1
+            slots = self.slots()
+            self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+            if self.slots() > slots:
+                self._wake()
+
+
+def _set_done(fut: asyncio.Future) -> None:
+    if not fut.done():
+        fut.set_result(None)
+
+
+_hosts: dict[str, HostConcurrency] = {}
+_hosts_lock = threading.Lock()
+
+
+def get_host_concurrency(host: str) -> HostConcurrency:
+    with _hosts_lock:
+        ctl = _hosts.get(host)
+        if ctl is None:
+            ctl = _hosts[host] = HostConcurrency(
+                host,
+                HOST_CONCURRENCY.get(host, CRAWL_HOST_CONCURRENCY),
+                HOST_MAX_CONCURRENCY.get(host, CRAWL_MAX_CONCURRENCY),
+            )
+        return ctl
+
+
+def host_concurrency(host: str) -> int:
+    return get_host_concurrency(host).slots()
+
+
+def host_metrics(hosts=None) -> dict[str, dict]:
+    """Current per-host limits for crawl metrics: {host: {limit, latency_ms, cuts}} (hosts None = all seen)."""
+    with _hosts_lock:
+        ctls = [c for h, c in _hosts.items() if hosts is None or h in hosts]
+    return {
+        c.host: {
+            "limit": c.slots(),
+            "latency_ms": round(c.latency * 1000) if c.latency is not None else None,
+            "cuts": c.cuts,
+        }
+        for c in ctls
+    }
+
+
+def _call(ctl: HostConcurrency, fn: Callable) -> Any:
+    try:
+        return fn()
+    finally:
+        ctl.release()
+
+
+async def crawl(jobs: Sequence[Job], return_exceptions: bool = False) -> list[Any]:
+    """Run jobs concurrently within per-host limits; results in job order. An exception from a job propagates
+    unless return_exceptions, then it is returned in the job's place."""
+    executor = _get_executor()
+
+    async def _run(url: str, fn: Callable, args: Sequence):
+        ctl = get_host_concurrency(urlsplit(url).netloc.lower())
+        await ctl.acquire()
+        fut = executor.submit(_call, ctl, partial(fn, *args))
+        try:
+            return await asyncio.wrap_future(fut)
+        finally:
+            # 已开始执行的任务由 _call 在真正结束时归还槽位（任务被取消时线程仍在跑）；未开始的在这里归还
+            if fut.cancel():
+                ctl.release()
+
+    return await asyncio.gather(*(_run(url, fn, args) for url, fn, args in jobs), return_exceptions=return_exceptions)
+
+
+def run_jobs(jobs: Sequence[Job], return_exceptions: bool = False) -> list[Any]:
+    """Sync wrapper of crawl() for the fetch_and_store_* functions (called from request and cron threads,
+    never from inside a running event loop). Logs the per-host limits after the run."""
+    if not jobs:
+        return []
+    start = time.perf_counter()
+    results = asyncio.run(crawl(jobs, return_exceptions=return_exceptions))
+    hosts = {urlsplit(url).netloc.lower() for url, _, _ in jobs}
+    limits = ", ".join(f"{h}={m['limit']}" for h, m in sorted(host_metrics(hosts).items()))
+    print(f"[crawl] {len(jobs)} queries in {time.perf_counter() - start:.1f}s; concurrency {limits}")
+    return results
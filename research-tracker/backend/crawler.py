@@ -1,20 +1,39 @@
 """arXiv paper crawler - uses arXiv REST API (no arxiv/feedparser, Python 3.13+ compatible)."""
+import json
 import logging
 import urllib.parse
 import xml.etree.ElementTree as ET
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
-import sqlite3
 import threading
 import time
 import requests
 
-from database import get_connection, init_db, load_crawl_keywords
+from cleanup import delete_rows
+from database import (
+    connection,
+    load_crawl_keywords,
+    load_paper_keys,
+    load_tag_memo,
+    load_valid_tag_versions,
+    normalize_title,
+)
+from crawl_engine import host_concurrency, run_jobs
+from http_cache import get_if_changed, remember
+from http_client import http_get
+from ingest import write_records
+from retag import mark_tag_rules_applied, retag_table, sync_tag_rules
 from tagging import (
     tag_paper,
+    tag_papers_batch,
+    tag_input_hash,
+    tag_rules_snapshot,
+    tag_rules_version,
+    tags_to_mask,
     tags_to_str,
     str_to_tags,
     BUSINESS_TAGS,
+    PAPER_TAG_FIELDS,
     PAPER_TAG_KEYWORDS,
     THREEDGS_KEYWORDS,
     THREEDGS_REQUIRED_TAGS,
@@ -75,7 +94,6 @@ def _build_s2_keywords(tag: str | None = None) -> list[str]:
 
 OPENREVIEW_API = "https://api.openreview.net/notes"
 OPENREVIEW_API_V2 = "https://api2.openreview.net/notes"
-OPENREVIEW_HEADERS = {"User-Agent": "ResearchTracker/1.0"}
 # (venue_id, display_name) - 使用 invitation 查询（content.venueid 实测返回空）
 # API v2 格式: {venue_id}/-/Submission; 部分旧会议用 Blind_Submission
 # ICLR/NeurIPS 可用 openreview-py 获取；CVF (CVPR/ICCV/ECCV) 在 OpenReview 上可能受限
@@ -89,8 +107,6 @@ OPENREVIEW_VENUES = [
 
 S2_API = "https://api.semanticscholar.org/graph/v1/paper/search"
 S2_FIELDS = "paperId,title,abstract,authors,publicationDate,year,venue,publicationVenue,citationCount,externalIds,url"
-S2_WORKERS = 4  # 并行请求数，避免触发 S2 限流（100 次/5 分钟）
-S2_TIMEOUT = 45  # 与 arXiv(60) 接近，S2 接口较慢易超时
 S2_RETRIES = 2  # 超时/连接失败时重试次数
 S2_DEFAULT_QUERIES = [
     "3D vision",
@@ -247,7 +263,7 @@ def _fetch_tag_papers(
                 "max_results": page_size,
             }
             try:
-                r = requests.get(ARXIV_API, params=params, timeout=60)
+                r = http_get(ARXIV_API, params=params)
                 r.raise_for_status()
                 root = ET.fromstring(r.content)
             except Exception:
@@ -321,25 +337,12 @@ def fetch_recent_papers(
             continue
         tasks.append((t, search_queries))
 
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = {
-            executor.submit(
-                _fetch_tag_papers,
-                t,
-                search_queries,
-                min_per_tag,
-                max_per_tag,
-                papers,
-                seen_ids,
-                lock,
-            ): t
-            for t, search_queries in tasks
-        }
-        for future in as_completed(futures):
-            try:
-                future.result()
-            except Exception:
-                pass
+    # 每个标签一个任务，由抓取引擎按 arXiv 的并发上限执行；单个标签失败不影响其他标签
+    jobs = [
+        (ARXIV_API, _fetch_tag_papers, (t, search_queries, min_per_tag, max_per_tag, papers, seen_ids, lock))
+        for t, search_queries in tasks
+    ]
+    run_jobs(jobs, return_exceptions=True)
 
     papers.sort(key=lambda x: x["published_at"] or "", reverse=True)
     return papers[:max_results]
@@ -350,28 +353,46 @@ def _openreview_val(v):
     return v.get("value", v) if isinstance(v, dict) else (v or "")
 
 
-def _fetch_openreview_via_rest_v2(venue_id: str, venue_name: str, cutoff_ms: int, seen_ids: set, max_results: int) -> list[dict]:
-    """Fallback: 直接用 requests 调用 api2.openreview.net/notes，不依赖 openreview-py。"""
+def _fetch_openreview_via_rest_v2(
+    venue_id: str,
+    venue_name: str,
+    cutoff_ms: int,
+    seen_ids: set,
+    max_results: int,
+    cache_scope: str = "",
+    cache_pending: list | None = None,
+) -> list[dict] | None:
+    """Fallback: 直接用 HTTP 调用 api2.openreview.net/notes，不依赖 openreview-py。
+    Returns None if the venue's listing is unchanged since the last fetch under cache_scope (already stored).
+    Cache entries of parsed pages go to cache_pending, written by the caller after storing."""
     papers = []
+    unchanged = False
     for inv_suffix in ["Submission", "Blind_Submission"]:
         invitation = f"{venue_id}/-/{inv_suffix}"
         offset = 0
         for _ in range(5):  # 最多 5 页
+            fresh = []
             try:
-                r = requests.get(
+                r, changed, body = get_if_changed(
                     OPENREVIEW_API_V2,
                     params={"invitation": invitation, "limit": min(100, max_results - len(papers)), "offset": offset, "sort": "tcdate:desc"},
-                    headers=OPENREVIEW_HEADERS,
-                    timeout=60,
+                    scope=cache_scope,
+                    pending=fresh,
                 )
                 r.raise_for_status()
-                data = r.json()
+                data = json.loads(body)
             except Exception as e:
                 log.warning("OpenReview API v2 %s: %s", invitation, e)
                 break
+            if cache_pending is not None:
+                cache_pending.extend(fresh)
             notes = data.get("notes", [])
             if not notes:
                 break
+            if not changed:
+                # 该页与上次相同：其中论文已处理过，不再逐条解析打标，也不再翻后续页
+                unchanged = True
+                break
             for note in notes:
                 note_id = note.get("id")
                 if not note_id or note_id in seen_ids:
@@ -412,7 +433,7 @@ def _fetch_openreview_via_rest_v2(venue_id: str, venue_name: str, cutoff_ms: int
                 break
         if papers:
             return papers
-    return papers
+    return None if unchanged else papers
 
 
 def _fetch_openreview_via_client(venue_id: str, venue_name: str, cutoff_ms: int, seen_ids: set, max_results: int) -> list[dict]:
@@ -491,8 +512,16 @@ def _fetch_openreview_via_client(venue_id: str, venue_name: str, cutoff_ms: int,
     return papers
 
 
-def fetch_openreview_papers(days: int = 15, max_results: int = 500, min_per_venue: int = 10, max_per_venue: int = 50) -> list[dict]:
-    """按会议抓取，每会议 min_per_venue～max_per_venue 篇。"""
+def fetch_openreview_papers(
+    days: int = 15,
+    max_results: int = 500,
+    min_per_venue: int = 10,
+    max_per_venue: int = 50,
+    cache_scope: str = "",
+    cache_pending: list | None = None,
+) -> list[dict]:
+    """按会议抓取，每会议 min_per_venue～max_per_venue 篇。REST 列表与上次抓取（同一 cache_scope）相同的会议跳过；
+    已解析列表页的缓存项放入 cache_pending，由调用方入库成功后写入。"""
     papers = []
     seen_ids = set()
     cutoff_ms = int(datetime(2024, 1, 1, tzinfo=timezone.utc).timestamp() * 1000)
@@ -515,8 +544,11 @@ def fetch_openreview_papers(days: int = 15, max_results: int = 500, min_per_venu
 
         # 回退到 api2.openreview.net REST（不依赖 openreview-py，部署环境无 openreview-py 时使用）
         rest_papers = _fetch_openreview_via_rest_v2(
-            venue_id, venue_name, cutoff_ms, seen_ids, venue_quota
+            venue_id, venue_name, cutoff_ms, seen_ids, venue_quota, cache_scope, cache_pending
         )
+        if rest_papers is None:
+            print(f"[OpenReview] {venue_name}: listing unchanged, skipped (REST v2)")
+            continue
         if rest_papers:
             papers.extend(rest_papers)
             print(f"[OpenReview] {venue_name}: {len(rest_papers)} papers (REST v2)")
@@ -537,19 +569,22 @@ def fetch_openreview_papers(days: int = 15, max_results: int = 500, min_per_venu
                     "offset": offset,
                     "sort": "cdate:desc",
                 }
+                fresh = []
                 try:
-                    r = requests.get(
-                        OPENREVIEW_API, params=params, headers=OPENREVIEW_HEADERS, timeout=60
-                    )
+                    r, changed, body = get_if_changed(OPENREVIEW_API, params=params, scope=cache_scope, pending=fresh)
                     r.raise_for_status()
-                    data = r.json()
+                    data = json.loads(body)
                 except Exception:
                     break
+                if cache_pending is not None:
+                    cache_pending.extend(fresh)
 
                 notes = data.get("notes", [])
                 if not notes:
                     break
                 got_any = True
+                if not changed:
+                    break  # 与上次相同，已处理过
 
                 for note in notes:
                     note_id = note.get("id")
@@ -617,10 +652,9 @@ def _fetch_s2_single(
 ) -> list[dict]:
     """Fetch papers for one S2 query. Returns list of paper dicts. Retries on timeout/connection error."""
     params = {"query": query, "limit": limit, "fields": S2_FIELDS}
-    headers = {"User-Agent": "ResearchTracker/1.0"}
     for attempt in range(S2_RETRIES + 1):
         try:
-            r = requests.get(S2_API, params=params, headers=headers, timeout=S2_TIMEOUT)
+            r = http_get(S2_API, params=params)
             r.raise_for_status()
             data = r.json()
             break
@@ -697,23 +731,19 @@ def fetch_semantic_scholar_papers(days: int = 15, max_results: int = 400) -> lis
     if not queries:
         queries = _build_s2_keywords()
 
-    for i in range(0, len(queries), S2_WORKERS):
-        batch = queries[i : i + S2_WORKERS]
-        limit = min(50, max(10, (max_results - len(papers)) // max(1, len(batch))))
-        with ThreadPoolExecutor(max_workers=S2_WORKERS) as ex:
-            futures = {
-                ex.submit(_fetch_s2_single, q, limit, cutoff): q
-                for q in batch
-            }
-            for future in as_completed(futures):
-                batch_papers = future.result()
-                for p in batch_papers:
-                    pid = p["id"]
-                    if pid not in seen_ids:
-                        seen_ids.add(pid)
-                        papers.append(p)
-        if i + S2_WORKERS < len(queries):
-            time.sleep(2)  # 避免 S2 限流
+    # 每个查询一个任务，并发数与请求速率分别由抓取引擎与 rate_limit 按 S2 的实际响应调整；按当前并发上限分批，
+    # 每批按剩余名额重新分配每个查询的条数（已抓到的越多，后面的查询取得越少）
+    i = 0
+    while i < len(queries):
+        batch = queries[i : i + host_concurrency(urllib.parse.urlsplit(S2_API).netloc)]
+        i += len(batch)
+        limit = min(50, max(10, (max_results - len(papers)) // len(batch)))
+        for batch_papers in run_jobs([(S2_API, _fetch_s2_single, (q, limit, cutoff)) for q in batch]):
+            for p in batch_papers:
+                pid = p["id"]
+                if pid not in seen_ids:
+                    seen_ids.add(pid)
+                    papers.append(p)
 
     papers.sort(key=lambda x: x["published_at"] or "", reverse=True)
     return papers[:max_results]
@@ -725,21 +755,12 @@ def _load_subscriptions(cursor):
 
 
 def _load_s2_queries():
-    conn = get_connection()
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
     try:
-        cursor.execute("SELECT query FROM s2_queries WHERE active = 1 ORDER BY created_at DESC")
-        rows = cursor.fetchall()
+        with connection() as conn:
+            rows = conn.execute("SELECT query FROM s2_queries WHERE active = 1 ORDER BY created_at DESC").fetchall()
         return [r["query"] for r in rows if r["query"]]
     except Exception:
         return []
-    finally:
-        conn.close()
-
-
-def _normalize_title(value: str) -> str:
-    return "".join(ch.lower() for ch in value if ch.isalnum() or ch.isspace()).strip()
 
 
 def _matches_subscription(paper: dict, sub) -> bool:
@@ -773,148 +794,136 @@ def fetch_and_store(days: int = 15, tag: str | None = None, source: str | None =
     tag: 选定标签时 arXiv 按该标签关键词抓取；S2/OpenReview 抓取后按该标签关键词过滤入库。
     source: 抓取来源，arxiv=仅 arXiv，s2=仅 S2，openreview=仅 OpenReview，空=全部。
     """
-    init_db()
     src = (source or "").strip().lower()
+    rules_version = tag_rules_version("papers")
+    tag_key = tag.strip() if tag and tag.strip() else None
+    # OpenReview 论文按打标结果（及指定的 tag）筛选入库：规则或 tag 不同时，未变化的会议列表也需重新处理
+    or_scope = f"openreview:{rules_version}:{tag_key or ''}"
+    cache_pending: list = []
     papers: list[dict] = []
     if src == "s2":
         papers = fetch_semantic_scholar_papers(days)
     elif src == "arxiv":
         papers = fetch_recent_papers(days=days, tag=tag)
     elif src == "openreview":
-        papers = fetch_openreview_papers(days=days)
+        papers = fetch_openreview_papers(days=days, cache_scope=or_scope, cache_pending=cache_pending)
     else:
+        # 三个来源同时启动（各占一个线程），各来源内部的请求经抓取引擎按主机自适应并发
         with ThreadPoolExecutor(max_workers=3) as ex:
             fut_arxiv = ex.submit(fetch_recent_papers, days=days, tag=tag)
             fut_s2 = ex.submit(fetch_semantic_scholar_papers, days)
-            fut_or = ex.submit(fetch_openreview_papers, days)
+            fut_or = ex.submit(fetch_openreview_papers, days, cache_scope=or_scope, cache_pending=cache_pending)
             papers = fut_arxiv.result() + fut_s2.result() + fut_or.result()
 
-    conn = get_connection()
-    cursor = conn.cursor()
-    subscriptions = _load_subscriptions(cursor)
-    inserted = 0
-    notifications = 0
-
+    records, notes = [], []
     for p in papers:
-        try:
-            cursor.execute("SELECT id FROM papers WHERE id = ?", (p["id"],))
-            existing = cursor.fetchone()
-            is_new = existing is None
-            if existing is None:
+        p["title_key"] = normalize_title(p.get("title"))
+    with connection() as conn:
+        cursor = conn.cursor()
+        subscriptions = _load_subscriptions(cursor)
+        valid_versions = load_valid_tag_versions(cursor, "papers", rules_version)
+        # 整批一次查出已有论文与已占用的 DOI / 链接 / 规范化标题；本批接受的论文随后加入，批内也去重
+        memo = load_tag_memo(cursor, "papers", [p["id"] for p in papers])
+        known_dois, known_urls, known_titles = load_paper_keys(
+            cursor,
+            (p.get("doi") for p in papers),
+            (p.get("url") for p in papers),
+            (p["title_key"] for p in papers),
+        )
+        accepted: set[str] = set()
+
+        for p in papers:
+            try:
+                existing = memo.get(p["id"])
+                is_new = existing is None and p["id"] not in accepted
                 doi = p.get("doi")
                 url = p.get("url")
-                title_key = _normalize_title(p.get("title", ""))
-                cursor.execute("""
-                    SELECT id FROM papers
-                    WHERE (doi IS NOT NULL AND doi = ?)
-                       OR (url IS NOT NULL AND url = ?)
-                       OR (LOWER(title) = ?)
-                    LIMIT 1
-                """, (doi, url, title_key))
-                dup = cursor.fetchone()
-                if dup is not None:
-                    is_new = False
+                title_key = p["title_key"]
+                if is_new and (doi in known_dois or url in known_urls or title_key in known_titles):
                     continue
-            tags_list = tag_paper(
-                p.get("title", ""),
-                p.get("abstract", ""),
-                p.get("categories", ""),
-                p.get("keywords", ""),
-                p.get("source", ""),
-                p.get("venue", ""),
-            )
-            if not any(t in BUSINESS_TAGS for t in tags_list):
-                continue
-            # OpenReview 论文必须至少有一个研究方向标签（仅会议标签不入库）
-            if p.get("source") == "openreview":
-                has_research = any(t in PAPER_TAG_KEYWORDS for t in tags_list)
-                if not has_research:
+                tag_hash = tag_input_hash(p.get(f) for f in PAPER_TAG_FIELDS)
+                if existing is not None and existing["tag_hash"] == tag_hash and existing["tag_version"] in valid_versions:
+                    tags_list = str_to_tags(existing["tags"])  # 内容与规则均未变，复用已有标签
+                else:
+                    tags_list = tag_paper(
+                        p.get("title", ""),
+                        p.get("abstract", ""),
+                        p.get("categories", ""),
+                        p.get("keywords", ""),
+                        p.get("source", ""),
+                        p.get("venue", ""),
+                    )
+                if not any(t in BUSINESS_TAGS for t in tags_list):
                     continue
-            # 指定 tag 时，S2 等抓到的论文也按该研究方向关键词过滤
-            tag_key = tag.strip() if tag and tag.strip() else None
-            if tag_key and tag_key in PAPER_TAG_KEYWORDS and tag_key not in tags_list:
-                continue
-            tags = tags_to_str(tags_list)
-            cursor.execute("""
-                INSERT OR REPLACE INTO papers
-                (id, title, abstract, authors, categories, pdf_url, arxiv_url, published_at, source, doi, url, affiliations, keywords, venue, citation_count, tags, updated_at)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                p["id"], p["title"], p["abstract"], p["authors"],
-                p["categories"], p["pdf_url"], p["arxiv_url"],
-                p["published_at"], p.get("source"), p.get("doi"),
-                p.get("url"), p.get("affiliations"), p.get("keywords"),
-                p.get("venue"), p.get("citation_count"), tags,
-                p["updated_at"]
-            ))
-            inserted += 1
-            if is_new and subscriptions:
-                for sub in subscriptions:
-                    if _matches_subscription(p, sub):
-                        cursor.execute("""
-                            INSERT INTO notifications (paper_id, subscription_id, reason)
-                            VALUES (?, ?, ?)
-                        """, (p["id"], sub["id"], f"{sub['type']}:{sub['value']}"))
-                        notifications += 1
-        except Exception as e:
-            print(f"Error inserting {p['id']}: {e}")
-
-    conn.commit()
-    conn.close()
+                # OpenReview 论文必须至少有一个研究方向标签（仅会议标签不入库）
+                if p.get("source") == "openreview":
+                    has_research = any(t in PAPER_TAG_KEYWORDS for t in tags_list)
+                    if not has_research:
+                        continue
+                # 指定 tag 时，S2 等抓到的论文也按该研究方向关键词过滤
+                if tag_key and tag_key in PAPER_TAG_KEYWORDS and tag_key not in tags_list:
+                    continue
+                records.append({**p, "tags": tags_to_str(tags_list), "tag_hash": tag_hash, "tag_version": rules_version})
+                accepted.add(p["id"])
+                for keys, value in ((known_dois, doi), (known_urls, url), (known_titles, title_key)):
+                    if value:
+                        keys.add(value)
+                if is_new and subscriptions:
+                    for sub in subscriptions:
+                        if _matches_subscription(p, sub):
+                            notes.append({
+                                "paper_id": p["id"],
+                                "subscription_id": sub["id"],
+                                "reason": f"{sub['type']}:{sub['value']}",
+                            })
+            except Exception as e:
+                print(f"Error inserting {p['id']}: {e}")
+
+    # 论文先于通知提交，ingest 线程按提交顺序写入
+    inserted, errors = write_records("papers", records)
+    notifications, note_errors = write_records("notifications", notes)
+    for e in errors + note_errors:
+        print(f"Error inserting {e}")
+    if not errors:
+        remember(cache_pending)  # 论文入库成功后才记下 OpenReview 列表的校验值，失败时下次重新处理
     return inserted, notifications
 
 
-def backfill_paper_tags(force: bool = False) -> int:
-    """Backfill tags for papers. If force=False, only papers with NULL/empty tags. Returns count updated."""
-    conn = get_connection()
-    cursor = conn.cursor()
+def backfill_paper_tags(force: bool = False, workers: int | None = None) -> int:
+    """Backfill tags for papers. If force=False, only papers with NULL/empty tags. Returns count updated.
+    workers: process count for tagging (None = TAG_WORKERS, 1 = in-process)."""
+    version = tag_rules_version("papers")
+    n = retag_table(
+        "papers",
+        PAPER_TAG_FIELDS,
+        tag_papers_batch,
+        version,
+        force=force,
+        workers=workers,
+    )
     if force:
-        cursor.execute("SELECT id, title, abstract, categories, keywords, source, venue FROM papers")
-    else:
-        cursor.execute(
-            "SELECT id, title, abstract, categories, keywords, source, venue FROM papers WHERE tags IS NULL OR tags = ''"
-        )
-    rows = cursor.fetchall()
-    updated = 0
-    for row in rows:
-        tags_list = tag_paper(
-            row["title"] or "",
-            row["abstract"] or "",
-            row["categories"] or "",
-            row["keywords"] or "",
-            row["source"] or "",
-            row["venue"] or "",
-        )
-        tags = tags_to_str(tags_list)
-        cursor.execute("UPDATE papers SET tags = ? WHERE id = ?", (tags, row["id"]))
-        updated += 1
-    conn.commit()
-    conn.close()
-    return updated
+        mark_tag_rules_applied("papers", version, tag_rules_snapshot("papers"))
+    return n
+
+
+def sync_paper_tag_rules(allow_full: bool = False) -> dict:
+    """Re-tag papers affected by keyword-table edits since the last applied rule set (see retag.sync_tag_rules)."""
+    return sync_tag_rules(
+        "papers",
+        PAPER_TAG_FIELDS,
+        tag_papers_batch,
+        tag_rules_snapshot("papers"),
+        tag_rules_version("papers"),
+        allow_full=allow_full,
+    )
 
 
 def cleanup_papers_without_business_tags(openreview_only: bool = False) -> int:
     """Delete papers that have no business tags. Returns count deleted.
     openreview_only: if True, only delete OpenReview papers without research direction tags."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, tags, source FROM papers")
-    rows = cursor.fetchall()
-    deleted = 0
-    for row in rows:
-        tags_list = str_to_tags(row["tags"] or "")
-        has_business = any(t in BUSINESS_TAGS for t in tags_list)
-        if not has_business:
-            cursor.execute("DELETE FROM notifications WHERE paper_id = ?", (row["id"],))
-            cursor.execute("DELETE FROM papers WHERE id = ?", (row["id"],))
-            deleted += 1
-            continue
-        if openreview_only and row["source"] == "openreview":
-            has_research = any(t in PAPER_TAG_KEYWORDS for t in tags_list)
-            if not has_research:
-                cursor.execute("DELETE FROM notifications WHERE paper_id = ?", (row["id"],))
-                cursor.execute("DELETE FROM papers WHERE id = ?", (row["id"],))
-                deleted += 1
-    conn.commit()
-    conn.close()
-    return deleted
+    # 业务标签与研究方向标签均在 TAG_BITS 中注册，按 tag_mask 判断即可
+    where, params = "(tag_mask & ?) = 0", [tags_to_mask(BUSINESS_TAGS)]
+    if openreview_only:
+        where += " OR (source = 'openreview' AND (tag_mask & ?) = 0)"
+        params.append(tags_to_mask(PAPER_TAG_KEYWORDS))
+    return delete_rows("papers", where, params)
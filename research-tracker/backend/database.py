@@ -1,8 +1,13 @@
 """SQLite database setup and operations."""
 import os
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Callable, Iterable, Iterator, Sequence
+
+from tagging import TAG_BITS, str_to_tags, tags_to_mask
 
 # Railway: 若挂载了 Volume，Railway 会自动设置 RAILWAY_VOLUME_MOUNT_PATH
 _mount = os.environ.get("RAILWAY_VOLUME_MOUNT_PATH")
@@ -12,6 +17,13 @@ if _mount:
 else:
     DB_PATH = Path(__file__).parent / "papers.db"
 
+# 连接参数：WAL 下读不阻塞写；cache_size 为负数表示 KiB
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "10000"))
+SQLITE_CACHE_SIZE_KB = int(os.getenv("SQLITE_CACHE_SIZE_KB", "32768"))
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+
+_local = threading.local()
+
 
 def _column_exists(cursor, table: str, column: str) -> bool:
     cursor.execute(f"PRAGMA table_info({table})")
@@ -24,11 +36,255 @@ def _ensure_columns(cursor, table: str, columns: dict[str, str]) -> None:
             cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
 
 
-def init_db():
-    """Initialize database with papers table."""
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    cursor = conn.cursor()
+# 全文索引（FTS5 trigram，子串匹配）：表 -> 索引列。打标关键词匹配与搜索共用
+FTS_COLUMNS: dict[str, tuple[str, ...]] = {
+    "papers": ("title", "abstract", "categories", "keywords", "authors"),
+    "posts": ("title", "summary", "channel", "author"),
+}
+_FTS_READY: dict[str, bool] = {}
+
+
+def _ensure_fts(cursor, table: str) -> bool:
+    """Create {table}_fts (external content, trigram) with sync triggers. Returns False if SQLite lacks FTS5/trigram."""
+    fts = f"{table}_fts"
+    columns = FTS_COLUMNS[table]
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts,))
+    existed = cursor.fetchone() is not None
+    if not existed:
+        try:
+            cursor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({', '.join(columns)}, "
+                f"content='{table}', content_rowid='rowid', tokenize='trigram')"
+            )
+        except sqlite3.OperationalError:
+            return False
+    cols = ", ".join(columns)
+    new_vals = ", ".join(f"new.{c}" for c in columns)
+    old_vals = ", ".join(f"old.{c}" for c in columns)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ai AFTER INSERT ON {table} BEGIN
+            INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_vals});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_ad AFTER DELETE ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_vals});
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {fts}_au AFTER UPDATE OF {cols} ON {table} BEGIN
+            INSERT INTO {fts}({fts}, rowid, {cols}) VALUES ('delete', old.rowid, {old_vals});
+            INSERT INTO {fts}(rowid, {cols}) VALUES (new.rowid, {new_vals});
+        END
+    """)
+    if not existed:
+        cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return True
+
+
+def has_fts(cursor, table: str) -> bool:
+    """Whether {table}_fts exists (FTS5 available and index built)."""
+    if table not in _FTS_READY:
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (f"{table}_fts",))
+        _FTS_READY[table] = cursor.fetchone() is not None
+    return _FTS_READY[table]
+
+
+def fts_phrase(text: str, columns: Sequence[str] | None = None) -> str | None:
+    """FTS5 MATCH expression finding text as a substring (in columns, if given). None when text is shorter
+    than 3 characters, which the trigram index cannot match: use LIKE instead."""
+    text = (text or "").strip()
+    if len(text) < 3:
+        return None
+    phrase = '"' + text.replace('"', '""') + '"'
+    return f"{{{' '.join(columns)}}} : {phrase}" if columns else phrase
+
+
+# 标签关联表：表 -> (关联表, 外键列, 冗余排序列)。按 (tag, 日期 DESC, id) 索引，标签筛选走索引区间扫描；
+# 冗余 source 供 tag_counts 按来源计数
+TAG_INDEX: dict[str, tuple[str, str, str]] = {
+    "papers": ("paper_tags", "paper_id", "published_at"),
+    "posts": ("post_tags", "post_id", "created_at"),
+}
+
+
+# 日期列：表 -> (原文本列, 整数 UTC 时间戳列)。文本列格式不一（YYYY-MM-DD、带时区 ISO、Z 结尾），
+# 日期筛选、排序与按保留期清理只用时间戳列；标签关联表同样冗余时间戳列
+EPOCH_COLUMNS: dict[str, tuple[str, str]] = {
+    "papers": ("published_at", "published_ts"),
+    "posts": ("created_at", "created_ts"),
+}
+
+
+def to_epoch(value: str | None) -> int | None:
+    """UTC epoch seconds of a stored date string: YYYY-MM-DD, ISO with offset or Z; no offset is taken as UTC.
+    None when empty or unparseable."""
+    if not value or not str(value).strip():
+        return None
+    text = str(value).strip()
+    try:
+        dt = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    except ValueError:
+        try:
+            dt = datetime.fromisoformat(text[:10])
+        except ValueError:
+            return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+
+def _ensure_tag_index(cursor, table: str) -> bool:
+    """Create the tag join table of table and its delete trigger; fill it from existing rows on first creation.
+    Returns True if join rows were (re)built."""
+    tag_table, id_col, date_col = TAG_INDEX[table]
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (tag_table,))
+    existed = cursor.fetchone() is not None
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {tag_table} (
+            {id_col} TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            {date_col} TEXT,
+            source TEXT,
+            PRIMARY KEY ({id_col}, tag)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{tag_table}_tag_{date_col}
+        ON {tag_table}(tag, {date_col} DESC, {id_col})
+    """)
+    # 删除（含清理与 INSERT OR REPLACE 替换旧行）由触发器同步；写入/改标签由 index_tags 同步
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS {tag_table}_ad AFTER DELETE ON {table} BEGIN
+            DELETE FROM {tag_table} WHERE {id_col} = old.id;
+        END
+    """)
+    if existed and not _column_exists(cursor, tag_table, "source"):
+        cursor.execute(f"ALTER TABLE {tag_table} ADD COLUMN source TEXT")
+        cursor.execute(f"UPDATE {tag_table} SET source = (SELECT source FROM {table} WHERE id = {tag_table}.{id_col})")
+        return True
+    if not existed:
+        for rows in iter_table_chunks(cursor, table, "id, tags", "tags IS NOT NULL AND tags != ''"):
+            # 基线迁移时尚无时间戳列，由迁移 006 回填
+            index_tags(cursor, table, [(r["id"], r["tags"]) for r in rows], with_ts=False)
+        return True
+    return False
+
+
+def _ensure_tag_counts(cursor, rebuild: bool = False) -> None:
+    """Create tag_counts (scope, source, tag) -> count, maintained by triggers on the join tables.
+    Rebuilt from the join tables when first created or when rebuild is set."""
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_counts'")
+    existed = cursor.fetchone() is not None
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tag_counts (
+            scope TEXT NOT NULL,
+            source TEXT NOT NULL,
+            tag TEXT NOT NULL,
+            count INTEGER NOT NULL,
+            PRIMARY KEY (scope, source, tag)
+        ) WITHOUT ROWID
+    """)
+    for table, (tag_table, _, _) in TAG_INDEX.items():
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {tag_table}_count_ai AFTER INSERT ON {tag_table} BEGIN
+                INSERT INTO tag_counts (scope, source, tag, count) VALUES ('{table}', COALESCE(new.source, ''), new.tag, 1)
+                ON CONFLICT (scope, source, tag) DO UPDATE SET count = count + 1;
+            END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {tag_table}_count_ad AFTER DELETE ON {tag_table} BEGIN
+                UPDATE tag_counts SET count = count - 1
+                WHERE scope = '{table}' AND source = COALESCE(old.source, '') AND tag = old.tag;
+            END
+        """)
+    if existed and not rebuild:
+        return
+    cursor.execute("DELETE FROM tag_counts")
+    for table, (tag_table, _, _) in TAG_INDEX.items():
+        cursor.execute(f"""
+            INSERT INTO tag_counts (scope, source, tag, count)
+            SELECT '{table}', COALESCE(source, ''), tag, COUNT(*) FROM {tag_table} GROUP BY 2, 3
+        """)
+
+
+def _ensure_tag_bits(cursor) -> None:
+    """Mirror TAG_BITS into tag_bits; when the registry changed (or tag_mask is new), recompute tag_mask from tags."""
+    cursor.execute("CREATE TABLE IF NOT EXISTS tag_bits (tag TEXT PRIMARY KEY, bit INTEGER NOT NULL)")
+    cursor.execute("SELECT tag, bit FROM tag_bits")
+    if {r["tag"]: r["bit"] for r in cursor.fetchall()} == TAG_BITS:
+        return
+    for table in TAG_INDEX:
+        for rows in iter_table_chunks(cursor, table, "id, tags"):
+            cursor.executemany(
+                f"UPDATE {table} SET tag_mask = ? WHERE id = ?",
+                [(tags_to_mask(str_to_tags(r["tags"])), r["id"]) for r in rows],
+            )
+    cursor.execute("DELETE FROM tag_bits")
+    cursor.executemany("INSERT INTO tag_bits (tag, bit) VALUES (?, ?)", TAG_BITS.items())
+
+
+def normalize_title(value: str | None) -> str:
+    """Dedup key of a paper title: lowercase letters/digits/whitespace only (punctuation dropped)."""
+    return "".join(ch.lower() for ch in (value or "") if ch.isalnum() or ch.isspace()).strip()
+
+
+def _ensure_title_key(cursor) -> None:
+    """Fill papers.title_key for rows stored before the column existed."""
+    cursor.connection.create_function("normalize_title", 1, normalize_title, deterministic=True)
+    cursor.execute("UPDATE papers SET title_key = normalize_title(title) WHERE title_key IS NULL")
+
+
+def index_tags(cursor, table: str, rows: Iterable[tuple[str, str | None]], with_ts: bool = True) -> None:
+    """Sync tag_mask and join-table entries of (id, tags string) rows. Call after writing the rows.
+    with_ts=False only for migrations that run before the epoch columns exist (006)."""
+    tag_table, id_col, date_col = TAG_INDEX[table]
+    rows = list(rows)
+    if not rows:
+        return
+    cursor.executemany(
+        f"UPDATE {table} SET tag_mask = ? WHERE id = ?",
+        [(tags_to_mask(str_to_tags(tags)), rid) for rid, tags in rows],
+    )
+    cursor.executemany(f"DELETE FROM {tag_table} WHERE {id_col} = ?", [(r[0],) for r in rows])
+    if with_ts:
+        date_col = f"{date_col}, {EPOCH_COLUMNS[table][1]}"
+    cursor.executemany(
+        f"INSERT OR IGNORE INTO {tag_table} ({id_col}, tag, {date_col}, source) "
+        f"SELECT id, ?, {date_col}, source FROM {table} WHERE id = ?",
+        [(t, rid) for rid, tags in rows for t in str_to_tags(tags)],
+    )
+
+
+def load_generation(cursor) -> int:
+    """Current data generation: changes whenever papers or posts are written (see migration 004)."""
+    row = cursor.execute("SELECT value FROM data_generation WHERE id = 0").fetchone()
+    return row[0] if row else 0
+
+
+def load_tag_counts(cursor, scope: str | None = None, source: str | None = None) -> dict[str, int]:
+    """Tag -> row count from tag_counts, optionally limited to scope (papers|posts) and source."""
+    conds, params = ["count > 0"], []
+    if scope:
+        conds.append("scope = ?")
+        params.append(scope)
+    if source:
+        conds.append("source = ?")
+        params.append(source)
+    cursor.execute(f"SELECT tag, SUM(count) AS n FROM tag_counts WHERE {' AND '.join(conds)} GROUP BY tag", params)
+    return {r["tag"]: r["n"] for r in cursor.fetchall()}
+
+
+def count_tags_by_mask(cursor, table: str, where: str = "", params: Iterable = ()) -> dict[str, int]:
+    """Per-tag row counts of registered tags (TAG_BITS) in one pass over tag_mask. where: optional SQL condition."""
+    sums = ", ".join(f"SUM((tag_mask >> {bit}) & 1)" for bit in TAG_BITS.values())
+    cursor.execute(f"SELECT {sums} FROM {table}" + (f" WHERE {where}" if where else ""), list(params))
+    row = cursor.fetchone()
+    return {tag: row[i] or 0 for i, tag in enumerate(TAG_BITS)}
+
+
+def _migrate_001_baseline(cursor) -> None:
+    """Schema as of the introduction of versioning. Idempotent, so unversioned databases of any age adopt it."""
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS papers (
             id TEXT PRIMARY KEY,
@@ -59,7 +315,16 @@ def init_db():
         "venue": "TEXT",
         "citation_count": "INTEGER",
         "tags": "TEXT",
+        "tag_hash": "TEXT",
+        "tag_version": "TEXT",
+        "tag_mask": "INTEGER NOT NULL DEFAULT 0",
+        "title_key": "TEXT",
     })
+    _ensure_title_key(cursor)
+    # 入库去重：按 DOI / 链接 / 规范化标题批量查找已有论文
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_papers_doi ON papers(doi) WHERE doi IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_papers_url ON papers(url) WHERE url IS NOT NULL")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_papers_title_key ON papers(title_key)")
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_papers_published 
         ON papers(published_at DESC)
@@ -138,7 +403,12 @@ def init_db():
             fetched_at TEXT DEFAULT CURRENT_TIMESTAMP
         )
     """)
-    _ensure_columns(cursor, "posts", {"tags": "TEXT"})
+    _ensure_columns(cursor, "posts", {
+        "tags": "TEXT",
+        "tag_hash": "TEXT",
+        "tag_version": "TEXT",
+        "tag_mask": "INTEGER NOT NULL DEFAULT 0",
+    })
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_posts_source 
         ON posts(source)
@@ -151,47 +421,325 @@ def init_db():
         CREATE INDEX IF NOT EXISTS idx_posts_source_created 
         ON posts(source, created_at DESC)
     """)
-    conn.commit()
-    conn.close()
+    # 打标规则版本历史：equivalent_to 非空表示该版本打标的行在目标版本下依然正确（增量重打标后）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS tag_rules (
+            scope TEXT NOT NULL,
+            version TEXT NOT NULL,
+            snapshot TEXT NOT NULL,
+            equivalent_to TEXT,
+            applied_seq INTEGER NOT NULL DEFAULT 0,
+            created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (scope, version)
+        )
+    """)
+    for table in FTS_COLUMNS:
+        _FTS_READY[table] = _ensure_fts(cursor, table)
+    rebuilt = [_ensure_tag_index(cursor, table) for table in TAG_INDEX]
+    _ensure_tag_counts(cursor, rebuild=any(rebuilt))
+
+
+# 结构迁移：按序号执行，每项只执行一次，已执行到的序号记录在 PRAGMA user_version。
+# 结构变更请在末尾追加新迁移，不要修改已发布的迁移
+def _migrate_002_notifications_paper_index(cursor) -> None:
+    """Index notifications by paper, so deleting papers' notifications is a lookup instead of a scan."""
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notifications_paper ON notifications(paper_id)")
+
+
+def _migrate_003_keyset_indexes(cursor) -> None:
+    """Indexes matching the list endpoints' keyset order (sort key DESC, id DESC), so each page is one range scan."""
+    cursor.execute("DROP INDEX IF EXISTS idx_papers_published")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_papers_published_id ON papers(published_at DESC, id DESC)")
+    cursor.execute("DROP INDEX IF EXISTS idx_posts_created")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_id ON posts(created_at DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_score_id ON posts(score DESC, id DESC)")
+    for tag_table, id_col, date_col in TAG_INDEX.values():
+        cursor.execute(f"DROP INDEX IF EXISTS idx_{tag_table}_tag_{date_col}")
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{tag_table}_tag_{date_col}_id
+            ON {tag_table}(tag, {date_col} DESC, {id_col} DESC)
+        """)
+
+
+def _migrate_004_data_generation(cursor) -> None:
+    """Single-row counter bumped by triggers on every write to papers/posts; list response caches key on it."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_generation (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            value INTEGER NOT NULL
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO data_generation (id, value) VALUES (0, 0)")
+    for table in ("papers", "posts"):
+        for event in ("INSERT", "UPDATE", "DELETE"):
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {table}_generation_{event.lower()} AFTER {event} ON {table} BEGIN
+                    UPDATE data_generation SET value = value + 1 WHERE id = 0;
+                END
+            """)
+
+
+def _migrate_005_clean_post_text(cursor) -> None:
+    """Clean text of posts stored before ingest did it (HTML, company source name), so /api/posts can serve columns as is."""
+    from ingest import clean_post_text
+    for rows in iter_table_chunks(cursor, "posts", "id, source, title, summary, author"):
+        changed = []
+        for row in rows:
+            post = clean_post_text(dict(row))
+            if (post["title"], post["summary"], post["author"]) != (row["title"], row["summary"], row["author"]):
+                changed.append((post["title"], post["summary"], post["author"], row["id"]))
+        # tag_hash 保持旧值：下次抓到同一条时按清洗后的文本重新打标
+        cursor.executemany("UPDATE posts SET title = ?, summary = ?, author = ? WHERE id = ?", changed)
+
+
+def _migrate_006_epoch_columns(cursor) -> None:
+    """Integer UTC epoch columns papers.published_ts / posts.created_ts (also on the tag join tables), backfilled
+    from the mixed-format date strings, and the keyset indexes moved onto them."""
+    cursor.connection.create_function("to_epoch", 1, to_epoch, deterministic=True)
+    for table, (date_col, ts_col) in EPOCH_COLUMNS.items():
+        tag_table, id_col, tag_date_col = TAG_INDEX[table]
+        _ensure_columns(cursor, table, {ts_col: "INTEGER"})
+        _ensure_columns(cursor, tag_table, {ts_col: "INTEGER"})
+        cursor.execute(f"UPDATE {table} SET {ts_col} = to_epoch({date_col})")
+        cursor.execute(f"UPDATE {tag_table} SET {ts_col} = (SELECT {ts_col} FROM {table} WHERE id = {tag_table}.{id_col})")
+        cursor.execute(f"DROP INDEX IF EXISTS idx_{tag_table}_tag_{tag_date_col}_id")
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS idx_{tag_table}_tag_{ts_col}_id
+            ON {tag_table}(tag, {ts_col} DESC, {id_col} DESC)
+        """)
+    cursor.execute("DROP INDEX IF EXISTS idx_papers_published_id")
+    cursor.execute("DROP INDEX IF EXISTS idx_papers_pub_source")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_papers_published_ts_id ON papers(published_ts DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_papers_source_published_ts ON papers(source, published_ts DESC, id DESC)")
+    cursor.execute("DROP INDEX IF EXISTS idx_posts_created_id")
+    cursor.execute("DROP INDEX IF EXISTS idx_posts_source_created")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_created_ts_id ON posts(created_ts DESC, id DESC)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_posts_source_created_ts ON posts(source, created_ts DESC, id DESC)")
+
+
+SCHEMA_MIGRATIONS: list[Callable] = [
+    _migrate_001_baseline,
+    _migrate_002_notifications_paper_index,
+    _migrate_003_keyset_indexes,
+    _migrate_004_data_generation,
+    _migrate_005_clean_post_text,
+    _migrate_006_epoch_columns,
+]
+SCHEMA_VERSION = len(SCHEMA_MIGRATIONS)
+
+
+def schema_version(cursor) -> int:
+    """Number of migrations applied to the database (0 = unversioned)."""
+    return cursor.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection) -> list[int]:
+    """Apply pending SCHEMA_MIGRATIONS, each in its own transaction together with its version bump.
+    Safe against concurrent starts: the version is re-read under the write lock. Returns the numbers applied."""
+    cursor = conn.cursor()
+    applied = []
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(cursor)
+            if version >= SCHEMA_VERSION:
+                conn.rollback()
+                break
+            SCHEMA_MIGRATIONS[version](cursor)
+            cursor.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        applied.append(version + 1)
+    if version > SCHEMA_VERSION:
+        print(f"[db] Schema version {version} is newer than this code ({SCHEMA_VERSION})")
+    return applied
+
+
+def full_vacuum(conn: sqlite3.Connection) -> None:
+    """Rewrite the whole database file (outside a transaction). The copy is staged in a temp file, not in
+    memory (temp_store=MEMORY would hold the entire database in RAM)."""
+    conn.execute("PRAGMA temp_store = FILE")
+    try:
+        conn.execute("VACUUM")
+    finally:
+        conn.execute("PRAGMA temp_store = MEMORY")
+
+
+def init_db():
+    """Bring the database schema up to SCHEMA_VERSION and sync the tag bit registry. Called once at startup;
+    crawlers and request handlers assume it has run."""
+    conn = get_connection()  # 迁移用独立连接，完成即关闭
+    try:
+        # 切换 auto_vacuum 需重写整库：新库为空，立即完成；已有数据的库不在启动时重写（耗时且临时约需一倍
+        # 磁盘空间），由 POST /api/cleanup/vacuum 在维护时一次性转换
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            if conn.execute("SELECT 1 FROM sqlite_master LIMIT 1").fetchone():
+                print("[db] auto_vacuum is not INCREMENTAL; POST /api/cleanup/vacuum converts it (one-time full VACUUM)")
+            else:
+                conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+                full_vacuum(conn)
+        applied = migrate(conn)
+        if applied:
+            print(f"[db] Applied schema migrations {applied[0]}..{applied[-1]} (now {SCHEMA_VERSION})")
+        # TAG_BITS 随代码变化，不属于结构迁移，每次启动核对
+        _ensure_tag_bits(conn.cursor())
+        conn.commit()
+    finally:
+        conn.close()
 
 
 def get_connection():
-    """Get database connection."""
-    conn = sqlite3.connect(DB_PATH)
+    """Open a new standalone connection (pragmas applied); the caller closes it.
+    Application code should use connection() instead."""
+    conn = sqlite3.connect(DB_PATH, timeout=SQLITE_BUSY_TIMEOUT_MS / 1000)
     conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}")
+    conn.execute(f"PRAGMA cache_size = -{SQLITE_CACHE_SIZE_KB}")
+    conn.execute(f"PRAGMA mmap_size = {SQLITE_MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    # INSERT OR REPLACE 删除旧行时需触发 DELETE 触发器，才能同步全文索引与标签关联表
+    conn.execute("PRAGMA recursive_triggers = ON")
     return conn
 
 
+@contextmanager
+def connection() -> Iterator[sqlite3.Connection]:
+    """Thread-local pooled connection: opened once per thread and reused.
+    Commits when the outermost block exits, rolls back on error. A nested block runs in a savepoint of the
+    outer transaction: on error only its own writes are undone, on success they commit with the outer block."""
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = _local.conn = get_connection()
+        _local.depth = 0
+    _local.depth += 1
+    savepoint = None
+    if _local.depth > 1:
+        if not conn.in_transaction:
+            conn.execute("BEGIN")  # 保存点须嵌在外层事务里，否则 RELEASE 会直接提交
+        savepoint = f"sp{_local.depth}"
+        conn.execute(f"SAVEPOINT {savepoint}")
+    try:
+        yield conn
+        if savepoint is None:
+            conn.commit()
+        elif conn.in_transaction:  # 内层代码自行 commit 过时保存点已随之释放
+            conn.execute(f"RELEASE {savepoint}")
+    except BaseException:
+        if savepoint is None:
+            conn.rollback()
+        elif conn.in_transaction:
+            conn.execute(f"ROLLBACK TO {savepoint}")
+            conn.execute(f"RELEASE {savepoint}")
+        raise
+    finally:
+        _local.depth -= 1
+
+
 def migrate_diffusion_to_multimodal_tag() -> int:
     """Replace 扩散模型 with 多模态 in papers and posts tags. Returns total rows updated."""
-    from tagging import str_to_tags, tags_to_str
-    conn = get_connection()
-    cursor = conn.cursor()
-    total = 0
-    for table in ("papers", "posts"):
-        cursor.execute(f"SELECT id, tags FROM {table} WHERE tags IS NOT NULL AND tags != '' AND tags LIKE '%扩散模型%'")
-        rows = cursor.fetchall()
-        for row in rows:
-            tags = str_to_tags(row["tags"])
-            if "扩散模型" not in tags:
-                continue
-            new_tags = [t if t != "扩散模型" else "多模态" for t in tags]
-            new_tags = list(dict.fromkeys(new_tags))  # dedupe
-            cursor.execute(f"UPDATE {table} SET tags = ? WHERE id = ?", (tags_to_str(new_tags), row["id"]))
-            total += 1
-    conn.commit()
-    conn.close()
+    from tagging import tags_to_str
+    with connection() as conn:
+        cursor = conn.cursor()
+        total = 0
+        for table in ("papers", "posts"):
+            cursor.execute(f"SELECT id, tags FROM {table} WHERE tags IS NOT NULL AND tags != '' AND tags LIKE '%扩散模型%'")
+            rows = cursor.fetchall()
+            for row in rows:
+                tags = str_to_tags(row["tags"])
+                if "扩散模型" not in tags:
+                    continue
+                new_tags = [t if t != "扩散模型" else "多模态" for t in tags]
+                new_tags = list(dict.fromkeys(new_tags))  # dedupe
+                cursor.execute(f"UPDATE {table} SET tags = ? WHERE id = ?", (tags_to_str(new_tags), row["id"]))
+                index_tags(cursor, table, [(row["id"], tags_to_str(new_tags))])
+                total += 1
     return total
 
 
+def iter_table_chunks(
+    cursor,
+    table: str,
+    columns: str,
+    where: str = "",
+    chunk_size: int = 1000,
+) -> Iterator[list[sqlite3.Row]]:
+    """Yield rows of table in rowid order, chunk_size at a time (keyset scan, bounded memory)."""
+    cond = f" AND ({where})" if where else ""
+    last = -(2 ** 63)
+    while True:
+        cursor.execute(
+            f"SELECT rowid AS _rowid, {columns} FROM {table} WHERE rowid > ?{cond} ORDER BY rowid LIMIT ?",
+            (last, chunk_size),
+        )
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        last = rows[-1]["_rowid"]
+        yield rows
+
+
+def load_tag_memo(cursor, table: str, ids: list[str], chunk_size: int = 500) -> dict[str, sqlite3.Row]:
+    """Existing rows' id -> (tags, tag_hash, tag_version), looked up in chunks. Used to skip re-tagging unchanged rows."""
+    memo = {}
+    unique_ids = list(dict.fromkeys(ids))
+    for i in range(0, len(unique_ids), chunk_size):
+        chunk = unique_ids[i : i + chunk_size]
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT id, tags, tag_hash, tag_version FROM {table} WHERE id IN ({placeholders})", chunk)
+        for row in cursor.fetchall():
+            memo[row["id"]] = row
+    return memo
+
+
+def load_paper_keys(
+    cursor,
+    dois: Iterable[str],
+    urls: Iterable[str],
+    title_keys: Iterable[str],
+    chunk_size: int = 500,
+) -> tuple[set[str], set[str], set[str]]:
+    """Which of the given DOIs / URLs / normalized titles already exist in papers, looked up in chunks
+    through their indexes. Returns (dois, urls, title_keys) found."""
+    found = []
+    for column, values in (("doi", dois), ("url", urls), ("title_key", title_keys)):
+        unique = [v for v in dict.fromkeys(values) if v]
+        hits: set[str] = set()
+        for i in range(0, len(unique), chunk_size):
+            chunk = unique[i : i + chunk_size]
+            placeholders = ",".join("?" * len(chunk))
+            cursor.execute(f"SELECT {column} FROM papers WHERE {column} IN ({placeholders})", chunk)
+            hits.update(r[0] for r in cursor.fetchall())
+        found.append(hits)
+    return found[0], found[1], found[2]
+
+
+def load_valid_tag_versions(cursor, scope: str, current: str) -> set[str]:
+    """Rule versions whose tagged rows are still correct under current (current plus versions upgraded to it incrementally)."""
+    cursor.execute("SELECT version, equivalent_to FROM tag_rules WHERE scope = ? AND equivalent_to IS NOT NULL", (scope,))
+    edges = {r["version"]: r["equivalent_to"] for r in cursor.fetchall()}
+    valid = {current}
+    for version in edges:
+        seen = set()
+        v = version
+        while v is not None and v not in seen and v not in valid:
+            seen.add(v)
+            v = edges.get(v)
+        if v in valid:
+            valid |= seen
+    return valid
+
+
 def load_crawl_keywords(scope: str) -> list[str]:
     """Load active crawl keywords for given scope. scope: papers|community|company|all."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT keyword FROM crawl_keywords WHERE active = 1 AND (scope = ? OR scope = 'all') ORDER BY created_at DESC",
-        (scope,),
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT keyword FROM crawl_keywords WHERE active = 1 AND (scope = ? OR scope = 'all') ORDER BY created_at DESC",
+            (scope,),
+        )
+        rows = cursor.fetchall()
     return [r["keyword"].strip() for r in rows if r["keyword"] and r["keyword"].strip()]
@@ -0,0 +1,126 @@
+"""On-disk conditional-request cache for feeds and listing endpoints (Google News / RSSHub RSS, Reddit
+new.json, OpenReview venue listings).
+
+get_if_changed revalidates with the ETag / Last-Modified and body kept in a small SQLite file next to the
+database (If-None-Match / If-Modified-Since). It reports whether the resource changed since the last fetch
+(a 304, or a 200 with an identical body from servers without validators, counts as unchanged), so the
+crawler skips parsing and tagging of a feed whose items are already stored; the body is returned alongside
+the response (the cached one when unchanged). A changed response is only
+collected in the caller's pending list; the crawler writes it with remember() after its items are stored,
+so a body whose processing or ingest failed is fetched and processed again. The scope is part of the key:
+callers put in it whatever else decides which items get stored (e.g. the days window), so an unchanged body
+fetched under a different scope is processed again. Entries not revalidated for HTTP_CACHE_MAX_AGE_DAYS are
+pruned, and cleanup drops the entries of a source whose rows it deleted (forget_sources), so its listings are
+processed again."""
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import requests
+
+from database import DB_PATH
+from http_client import http_get
+
+HTTP_CACHE_PATH = Path(os.getenv("HTTP_CACHE_PATH") or DB_PATH.with_name("http_cache.db"))
+# 设为 0 时关闭条件请求缓存（每次都完整抓取并解析）
+HTTP_CACHE_ENABLED = os.getenv("HTTP_CACHE", "1") != "0"
+# 超过该天数未再验证的缓存项（旧的时间窗口 / 规则版本等范围）在写入时清除
+HTTP_CACHE_MAX_AGE_DAYS = max(1, int(os.getenv("HTTP_CACHE_MAX_AGE_DAYS", "30")))
+# 来源 -> 缓存范围前缀（与各抓取函数的 cache_scope 对应）
+SOURCE_SCOPES = {"openreview": "openreview:", "reddit": "reddit:", "company": "company:"}
+
+_conn: sqlite3.Connection | None = None
+_lock = threading.Lock()
+
+
+def _db() -> sqlite3.Connection:
+    # 缓存库与业务库分开，抓取线程写缓存不与入库写入线程争锁；调用方持有 _lock
+    global _conn
+    if _conn is None:
+        _conn = sqlite3.connect(HTTP_CACHE_PATH, check_same_thread=False, isolation_level=None)
+        _conn.execute("PRAGMA journal_mode = WAL")
+        _conn.execute("PRAGMA synchronous = NORMAL")
+        _conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS http_cache (
+                key TEXT PRIMARY KEY,
+                etag TEXT,
+                last_modified TEXT,
+                body BLOB NOT NULL,
+                fetched_at INTEGER NOT NULL
+            )
+            """
+        )
+    return _conn
+
+
+def get_if_changed(
+    url: str,
+    params=None,
+    scope: str = "",
+    headers: dict | None = None,
+    timeout: float | None = None,
+    pending: list | None = None,
+) -> tuple[requests.Response, bool, bytes]:
+    """GET url via http_get with the cached validators. Returns (response, changed, body); when unchanged since
+    the last fetch under scope, body is the cached one. Otherwise callers raise_for_status as usual.
+    The cache entry of a changed 200 response is appended to pending (nothing is cached without it); pass the
+    list to remember() once the response's items are stored."""
+    if not HTTP_CACHE_ENABLED:
+        r = http_get(url, params=params, headers=headers, timeout=timeout)
+        return r, True, r.content
+    key = f"{scope} {requests.Request('GET', url, params=params).prepare().url}"
+    with _lock:
+        row = _db().execute("SELECT etag, last_modified, body FROM http_cache WHERE key = ?", (key,)).fetchone()
+    conditional = dict(headers or {})
+    if row:
+        etag, last_modified, _ = row
+        if etag:
+            conditional["If-None-Match"] = etag
+        if last_modified:
+            conditional["If-Modified-Since"] = last_modified
+    r = http_get(url, params=params, headers=conditional, timeout=timeout)
+    if r.status_code == 304 and row:
+        with _lock:
+            _db().execute("UPDATE http_cache SET fetched_at = ? WHERE key = ?", (int(time.time()), key))
+        return r, False, row[2]
+    if r.status_code != 200:
+        return r, True, r.content
+    entry = (key, r.headers.get("ETag"), r.headers.get("Last-Modified"), r.content)
+    if row and r.content == row[2]:
+        remember([entry])  # 内容与已处理过的相同，可直接更新校验值
+        return r, False, r.content
+    if pending is not None:
+        pending.append(entry)
+    return r, True, r.content
+
+
+def remember(pending: list) -> None:
+    """Write the cache entries collected by get_if_changed; call after their items were stored. Also prunes
+    entries not revalidated within HTTP_CACHE_MAX_AGE_DAYS."""
+    if not pending:
+        return
+    now = int(time.time())
+    with _lock:
+        conn = _db()
+        conn.executemany(
+            "INSERT OR REPLACE INTO http_cache (key, etag, last_modified, body, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            [(*entry, now) for entry in pending],
+        )
+        conn.execute("DELETE FROM http_cache WHERE fetched_at < ?", (now - HTTP_CACHE_MAX_AGE_DAYS * 86400,))
+
+
+def forget_sources(sources) -> int:
+    """Drop the cache entries of sources (papers/posts source values) whose stored rows were deleted, so their
+    listings are not skipped as unchanged next time. Returns entries removed."""
+    prefixes = [SOURCE_SCOPES[s] for s in set(sources) if s in SOURCE_SCOPES]
+    if not prefixes or not HTTP_CACHE_ENABLED or not HTTP_CACHE_PATH.exists():
+        return 0
+    with _lock:
+        conn = _db()
+        return sum(
+            conn.execute("DELETE FROM http_cache WHERE substr(key, 1, ?) = ?", (len(p), p)).rowcount
+            for p in prefixes
+        )
@@ -0,0 +1,90 @@
+"""Shared HTTP client for all crawlers: one pooled keep-alive session per host, a common User-Agent,
+proxies from the environment, central timeouts and per-host rate limiting (rate_limit). Every response or
+timeout is reported to the host's adaptive concurrency limit (crawl_engine.HostConcurrency)."""
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from crawl_engine import get_host_concurrency
+from rate_limit import HTTP_RETRY_MAX_WAIT, get_limiter
+
+USER_AGENT = "ResearchTracker/1.0"
+# 默认超时（秒）；慢接口按主机单独设置
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "20"))
+HOST_TIMEOUTS: dict[str, float] = {
+    "export.arxiv.org": 60,
+    "api.openreview.net": 60,
+    "api2.openreview.net": 60,
+    "api.semanticscholar.org": 45,  # S2 接口较慢易超时
+    "news.google.com": 15,
+    "www.reddit.com": 15,
+    "api.github.com": 15,
+}
+# 每个主机连接池保留的 keep-alive 连接数（并发超过时多出的连接用完即关）
+HTTP_POOL_SIZE = max(1, int(os.getenv("HTTP_POOL_SIZE", "16")))
+# 被限流（429/503）后按 Retry-After 等待重试的次数
+HTTP_RETRIES = max(0, int(os.getenv("HTTP_RETRIES", "2")))
+
+_sessions: dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def get_proxies() -> dict | None:
+    """Proxies from HTTPS_PROXY / HTTP_PROXY (Reddit、YouTube、Google News 等需代理时使用)."""
+    proxy = os.environ.get("HTTPS_PROXY") or os.environ.get("HTTP_PROXY")
+    if proxy and proxy.strip():
+        return {"http": proxy.strip(), "https": proxy.strip()}
+    return None
+
+
+def _host(url: str) -> str:
+    return urlsplit(url).netloc.lower()
+
+
+def get_session(url: str) -> requests.Session:
+    """Pooled session for url's host, created on first use and shared by all crawler threads."""
+    host = _host(url)
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=HTTP_POOL_SIZE)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers["User-Agent"] = USER_AGENT
+            proxies = get_proxies()
+            if proxies:
+                session.proxies.update(proxies)
+            _sessions[host] = session
+        return session
+
+
+def http_get(url: str, params=None, headers: dict | None = None, timeout: float | None = None, **kwargs) -> requests.Response:
+    """GET url through its host's pooled session, paced by the host's rate limiter. headers are added to the
+    session's; timeout defaults to HOST_TIMEOUTS for the host, else HTTP_TIMEOUT. A throttled response
+    (429/503) is retried up to HTTP_RETRIES times after its Retry-After delay; the last response is returned
+    as is. Raises requests exceptions as requests.get does."""
+    host = _host(url)
+    if timeout is None:
+        timeout = HOST_TIMEOUTS.get(host, HTTP_TIMEOUT)
+    limiter = get_limiter(host)
+    concurrency = get_host_concurrency(host)
+    for attempt in range(HTTP_RETRIES + 1):
+        queued_at = time.monotonic()
+        sent_at = limiter.acquire()
+        try:
+            r = get_session(url).get(url, params=params, headers=headers, timeout=timeout, **kwargs)
+        except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+            concurrency.record(sent_at, None)
+            raise
+        concurrency.record(sent_at, r.status_code, paced=sent_at - queued_at > 0.001)
+        wait = limiter.observe(r, sent_at)
+        if wait is None or attempt == HTTP_RETRIES or wait > HTTP_RETRY_MAX_WAIT:
+            return r
+        print(f"[http] {host} 返回 {r.status_code}，{wait:.0f}s 后重试 ({attempt + 1}/{HTTP_RETRIES})")
+        r.close()
+    return r
@@ -0,0 +1,198 @@
+"""Single-writer ingest: crawlers hand normalized records to one writer thread that commits them in batches."""
+import html
+import os
+import queue
+import re
+import threading
+from concurrent.futures import Future
+
+from database import EPOCH_COLUMNS, get_connection, index_tags, to_epoch
+
+# 队列上限（任务数，满时提交方阻塞）、每个任务的行数、单个事务最多合并的任务数
+INGEST_QUEUE_SIZE = max(1, int(os.getenv("INGEST_QUEUE_SIZE", "64")))
+INGEST_BATCH_SIZE = max(1, int(os.getenv("INGEST_BATCH_SIZE", "500")))
+INGEST_MAX_JOBS_PER_COMMIT = 16
+
+# 表 -> 写入列（记录为以列名为键的 dict）
+INGEST_COLUMNS: dict[str, tuple[str, ...]] = {
+    "papers": (
+        "id", "title", "abstract", "authors", "categories", "pdf_url", "arxiv_url", "published_at", "source",
+        "doi", "url", "affiliations", "keywords", "venue", "citation_count", "tags", "tag_hash", "tag_version",
+        "updated_at", "title_key", "published_ts",
+    ),
+    "posts": (
+        "id", "source", "title", "url", "author", "score", "comment_count", "summary", "channel",
+        "tags", "tag_hash", "tag_version", "created_at", "created_ts",
+    ),
+    "notifications": ("paper_id", "subscription_id", "reason"),
+}
+# 带标签的表写入后需同步 tag_mask 与标签关联表
+_TAGGED_TABLES = ("papers", "posts")
+
+
+def strip_html(text: str) -> str:
+    """Remove HTML tags and decode entities. Handles Google News RSS HTML format."""
+    if not text:
+        return ""
+    # 先 unescape，再移除所有 HTML 标签（包括多行、属性含引号等）
+    text = html.unescape(text)
+    text = re.sub(r"<[^>]+>", "", text, flags=re.DOTALL)
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def clean_post_text(post: dict) -> dict:
+    """Post with display-ready text: HTML stripped from title/summary, author trimmed, and company news summaries
+    without the repeated source name. Applied once when a post is normalized, so /api/posts serves stored columns."""
+    title = strip_html(post.get("title") or "") or post.get("title") or ""
+    summary = strip_html(post.get("summary") or "") or post.get("summary") or ""
+    author = (post.get("author") or "").strip()
+    # 公司新闻：去掉 summary 中重复的来源信息
+    if post.get("source") == "company" and author:
+        if summary.startswith(f"{author} - "):
+            summary = summary[len(author) + 3 :].strip()
+        # 去掉末尾的 " 来源"（Google News 格式常在 summary 末尾带来源）
+        for suffix in [f"  {author}", f" {author}", author]:
+            if summary.endswith(suffix):
+                summary = summary[:-len(suffix)].strip()
+                break
+    return {**post, "title": title, "summary": summary, "author": author}
+
+
+def _statement(table: str) -> str:
+    columns = INGEST_COLUMNS[table]
+    if table == "notifications":
+        # 并发抓取可能把同一篇新论文各判为新增一次；写入线程串行执行，在此去重即可
+        return """
+            INSERT INTO notifications (paper_id, subscription_id, reason)
+            SELECT ?, ?, ? WHERE NOT EXISTS (
+                SELECT 1 FROM notifications WHERE paper_id = ? AND subscription_id IS ?
+            )
+        """
+    return f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+
+
+def _params(table: str, record: dict) -> tuple:
+    if table in EPOCH_COLUMNS:
+        # 整数时间戳由文本日期派生，抓取方无需填写
+        date_col, ts_col = EPOCH_COLUMNS[table]
+        record = {**record, ts_col: to_epoch(record.get(date_col))}
+    params = tuple(record.get(c) for c in INGEST_COLUMNS[table])
+    if table == "notifications":
+        params += (record.get("paper_id"), record.get("subscription_id"))
+    return params
+
+
+class IngestWriter:
+    """Owns the only crawler write connection. Jobs (table, records) are queued in submit order;
+    the writer thread drains what is queued, writes each job with one executemany and commits
+    them together. If a commit fails, its jobs are retried row by row so one bad record does not
+    drop the rest. If the write connection cannot be opened, queued and later jobs fail with that error
+    (get_writer then starts a new writer)."""
+
+    def __init__(self, maxsize: int = INGEST_QUEUE_SIZE):
+        self._queue: queue.Queue = queue.Queue(maxsize=maxsize)
+        self.error: BaseException | None = None
+        self._thread = threading.Thread(target=self._run, name="ingest-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, table: str, records: list[dict]) -> Future:
+        """Queue records for table (blocks while the queue is full). Future result: (rows written, errors)."""
+        if table not in INGEST_COLUMNS:
+            raise ValueError(f"unknown ingest table: {table}")
+        fut: Future = Future()
+        if self.error is not None:
+            fut.set_exception(self.error)
+            return fut
+        self._queue.put((table, records, fut))
+        if self.error is not None:
+            self._fail_queued()  # 写入线程在放入前后退出：不会再有人处理队列
+        return fut
+
+    def _fail_queued(self) -> None:
+        while True:
+            try:
+                _, _, fut = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            fut.set_exception(self.error)
+
+    def _run(self) -> None:
+        try:
+            conn = get_connection()
+        except Exception as e:
+            # 库被锁、不存在或只读：写入线程无法工作，让等待中的抓取立即得到错误而不是永远阻塞
+            print(f"[ingest] Cannot open write connection: {e}")
+            self.error = e
+            self._fail_queued()
+            return
+        while True:
+            jobs = [self._queue.get()]
+            while len(jobs) < INGEST_MAX_JOBS_PER_COMMIT:
+                try:
+                    jobs.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = [self._write(conn, table, records) for table, records, _ in jobs]
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                try:
+                    results = [self._write_rows(conn, table, records) for table, records, _ in jobs]
+                    conn.commit()
+                except Exception as e:
+                    conn.rollback()
+                    for _, _, fut in jobs:
+                        fut.set_exception(e)
+                    continue
+            for (_, _, fut), result in zip(jobs, results):
+                fut.set_result(result)
+
+    @staticmethod
+    def _write(conn, table: str, records: list[dict]) -> tuple[int, list[str]]:
+        cursor = conn.cursor()
+        cursor.executemany(_statement(table), [_params(table, r) for r in records])
+        if table in _TAGGED_TABLES:
+            index_tags(cursor, table, [(r["id"], r.get("tags")) for r in records])
+            return len(records), []
+        return max(cursor.rowcount, 0), []
+
+    @staticmethod
+    def _write_rows(conn, table: str, records: list[dict]) -> tuple[int, list[str]]:
+        cursor = conn.cursor()
+        written, errors = 0, []
+        for r in records:
+            try:
+                cursor.execute(_statement(table), _params(table, r))
+                if table in _TAGGED_TABLES:
+                    index_tags(cursor, table, [(r["id"], r.get("tags"))])
+                written += max(cursor.rowcount, 0) if table not in _TAGGED_TABLES else 1
+            except Exception as e:
+                errors.append(f"{r.get('id', r.get('paper_id', ''))}: {e}")
+        return written, errors
+
+
+_WRITER: IngestWriter | None = None
+_WRITER_LOCK = threading.Lock()
+
+
+def get_writer() -> IngestWriter:
+    """Process-wide ingest writer, started on first use (and again after one failed to start)."""
+    global _WRITER
+    with _WRITER_LOCK:
+        if _WRITER is None or _WRITER.error is not None:
+            _WRITER = IngestWriter()
+        return _WRITER
+
+
+def write_records(table: str, records: list[dict]) -> tuple[int, list[str]]:
+    """Write records through the ingest writer in INGEST_BATCH_SIZE jobs and wait until committed.
+    Returns (rows written, per-row errors)."""
+    writer = get_writer()
+    futures = [writer.submit(table, records[i : i + INGEST_BATCH_SIZE]) for i in range(0, len(records), INGEST_BATCH_SIZE)]
+    written, errors = 0, []
+    for fut in futures:
+        n, errs = fut.result()
+        written += n
+        errors.extend(errs)
+    return written, errors
@@ -1,19 +1,34 @@
 """FastAPI backend for research paper tracker."""
+import base64
+import binascii
+import hashlib
+import heapq
+import json
 import os
+import threading
+import time
+from collections import OrderedDict
+from itertools import islice
 from pathlib import Path
-from time import time
 from dotenv import load_dotenv
 load_dotenv(Path(__file__).parent / ".env")
 
-from fastapi import FastAPI, Query, Body
+from fastapi import FastAPI, HTTPException, Query, Body, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from datetime import datetime, timedelta
-from database import init_db, get_connection, migrate_diffusion_to_multimodal_tag
-from crawler import fetch_and_store, backfill_paper_tags, cleanup_papers_without_business_tags
+from datetime import datetime, timedelta, timezone
+from database import EPOCH_COLUMNS, TAG_INDEX, count_tags_by_mask, fts_phrase, has_fts, connection, init_db, load_generation, load_tag_counts, migrate_diffusion_to_multimodal_tag, to_epoch
+from crawler import fetch_and_store, backfill_paper_tags, sync_paper_tag_rules, cleanup_papers_without_business_tags
 from cleanup import run_cleanup, run_vacuum
-from community_crawler import fetch_and_store_posts
-from company_crawler import fetch_and_store_company_posts, COMPANY_DIRECTIONS, _strip_html as strip_html
+from community_crawler import fetch_and_store_posts, backfill_post_tags, sync_post_tag_rules
+from company_crawler import fetch_and_store_company_posts, COMPANY_DIRECTIONS
 from code_crawler import fetch_and_store_code_posts
+from crawl_engine import host_metrics
+from tagging import TAG_BITS, tags_to_mask
+
+try:
+    import orjson  # 列表响应编码；未安装时回退标准库 json
+except ImportError:
+    orjson = None
 
 app = FastAPI(title="Research Tracker API", version="1.0.0")
 
@@ -23,6 +38,7 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor"],
 )
 
 
@@ -33,6 +49,11 @@ def startup():
     m = migrate_diffusion_to_multimodal_tag()
     if m > 0:
         print(f"[startup] Migrated 扩散模型->多模态 for {m} rows")
+    # 关键词表有增删时，仅重打标包含这些关键词的行；其他规则变更需手动强制补全
+    for scope, sync in (("papers", sync_paper_tag_rules), ("posts", sync_post_tag_rules)):
+        r = sync()
+        if r["mode"] == "pending":
+            print(f"[startup] Tag rules for {scope} changed beyond keywords; run POST /api/backfill-tags?force=true&posts=true")
     # Backfill tags for existing papers that have NULL/empty tags (enables tag filtering)
     n = backfill_paper_tags()
     if n > 0:
@@ -49,12 +70,231 @@ def root():
     }
 
 
-def _normalize_date(value: str | None) -> str | None:
-    if not value:
+def _date_bound(value: str, end: bool = False) -> int:
+    """UTC epoch bound of a from_date / to_date value; a bare to_date (YYYY-MM-DD) includes that whole day.
+    Raises 400 when the date cannot be parsed."""
+    ts = to_epoch(value)
+    if ts is None:
+        raise HTTPException(status_code=400, detail=f"Invalid date: {value}")
+    if end and len(value.strip()) == 10:
+        ts += 86400 - 1
+    return ts
+
+
+def _split_text_filters(table: str, filters) -> tuple[str, str, list]:
+    """Split (value, columns) text filters into one FTS5 MATCH expression over {table}_fts and LIKE
+    conditions (alias p) for the rest: no FTS5, or terms shorter than 3 characters."""
+    with connection() as conn:
+        use_fts = has_fts(conn.cursor(), table)
+    exprs, like_sql, like_params = [], "", []
+    for value, columns in filters:
+        if not value:
+            continue
+        expr = fts_phrase(value, columns) if use_fts else None
+        if expr:
+            exprs.append(expr)
+        else:
+            like_sql += " AND (" + " OR ".join(f"p.{c} LIKE ?" for c in columns) + ")"
+            like_params.extend([f"%{value}%"] * len(columns))
+    return " AND ".join(exprs), like_sql, like_params
+
+
+# 游标分页：游标记录排序方式与上一页末行的排序键（相关度排序时为偏移量），base64 编码，对客户端不透明
+def _encode_cursor(mode: str, values: list) -> str:
+    raw = json.dumps([mode, *values], ensure_ascii=False, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str | None, mode: str) -> list | None:
+    """Values of a cursor issued for sort mode; None when no cursor. Raises 400 on a malformed or mismatched cursor."""
+    if not cursor:
         return None
-    if len(value) == 10:
-        return f"{value}T00:00:00"
-    return value
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, binascii.Error):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    size = 2 if mode == "relevance" else 4
+    if not isinstance(values, list) or len(values) != size or values[0] != mode:
+        raise HTTPException(status_code=400, detail="Cursor does not match this sort")
+    if mode == "relevance":
+        valid = type(values[1]) is int and values[1] >= 0  # 偏移量
+    else:
+        valid = values[1] in (0, 1) and isinstance(values[2], (int, type(None))) and isinstance(values[3], str)
+    if not valid:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values[1:]
+
+
+def _fetch_page(conn, select: str, query: str, params: list, mode: str, keys, after: list | None, limit: int, head=None, tail=None):
+    """Run SELECT {select} {query} (FROM ... WHERE ..., alias p) for one page after cursor values, in two ranges:
+    head rows ordered by (sort, id) DESC, one range scan on the matching index whatever the depth, then tail rows
+    (no usable sort value) by id DESC.
+    keys: (sort column, id column), selected after select as the last two values of each row. head / tail:
+    (condition, params) selecting the two ranges; default sort value NOT NULL / NULL. head may also be a list of
+    disjoint ranges (e.g. per-source date windows): each is scanned in order with its own LIMIT and they are merged;
+    there is no tail then unless one is given.
+    Returns (rows as tuples, next cursor or None)."""
+    sort_col, id_col = keys
+    if isinstance(head, list):
+        heads = head
+    else:
+        heads = [head or (f"{sort_col} IS NOT NULL", [])]
+        tail = tail or (f"{sort_col} IS NULL", [])
+    query = f"SELECT {select}, {sort_col}, {id_col} {query}"
+    cur = conn.cursor()
+    cur.row_factory = None  # 元组行，直接按位置取值编码
+    rows = []
+    if after is None or after[0] == 0:
+        keyset, keyset_params = "", []
+        if after:
+            keyset, keyset_params = f" AND ({sort_col}, {id_col}) < (?, ?)", after[1:]
+        order = f" ORDER BY {sort_col} DESC, {id_col} DESC LIMIT ?"
+        ranges = [
+            cur.execute(query + f" AND ({cond})" + keyset + order, [*params, *cond_params, *keyset_params, limit + 1]).fetchall()
+            for cond, cond_params in heads
+        ]
+        if len(ranges) == 1:
+            rows = ranges[0]
+        else:
+            # 各区间已按 (sort, id) DESC 有序，归并取前 limit + 1 行，不需要整体排序
+            rows = list(islice(heapq.merge(*ranges, key=lambda r: (r[-2], r[-1]), reverse=True), limit + 1))
+    head_count = len(rows)
+    if tail and len(rows) <= limit:
+        cond, cond_params = f" AND ({tail[0]})", list(tail[1])
+        if after and after[0] == 1:
+            cond += f" AND {id_col} < ?"
+            cond_params.append(after[2])
+        order = f" ORDER BY {id_col} DESC LIMIT ?"
+        rows += cur.execute(query + cond + order, [*params, *cond_params, limit + 1 - len(rows)]).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    rows = rows[:limit]
+    phase = 0 if head_count >= limit else 1
+    return rows, _encode_cursor(mode, [phase, rows[-1][-2], rows[-1][-1]])
+
+
+def _fetch_ranked_page(conn, select: str, query: str, params: list, order: str, after: list | None, limit: int):
+    """Relevance-ordered page as tuples: bm25 rank is not an index key, so the cursor carries an offset."""
+    offset = after[0] if after and isinstance(after[0], int) and after[0] > 0 else 0
+    cur = conn.cursor()
+    cur.row_factory = None
+    sql = f"SELECT {select} {query} ORDER BY {order} LIMIT ? OFFSET ?"
+    rows = cur.execute(sql, [*params, limit + 1, offset]).fetchall()
+    if len(rows) <= limit:
+        return rows, None
+    return rows[:limit], _encode_cursor("relevance", [offset + limit])
+
+
+# 列表字段 -> 查询表达式（别名 p）；fields= 只查询并返回所列字段
+PAPER_FIELDS: dict[str, str] = {
+    name: f"p.{name}"
+    for name in (
+        "id", "title", "abstract", "authors", "categories", "pdf_url", "arxiv_url", "published_at", "source",
+        "doi", "url", "affiliations", "keywords", "venue", "citation_count", "tags",
+    )
+}
+
+
+POST_FIELDS: dict[str, str] = {
+    name: f"p.{name}"
+    for name in ("id", "source", "title", "url", "author", "score", "comment_count", "summary", "channel", "tags", "created_at")
+}
+
+
+def _parse_fields(fields: str | None, available: dict[str, str]) -> list[str]:
+    """Field names requested by fields= (comma-separated), in the order of available; all when empty."""
+    if not fields or not fields.strip():
+        return list(available)
+    wanted = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = wanted - available.keys()
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return [f for f in available if f in wanted]
+
+
+def _select_list(names: list[str], available: dict[str, str], truncate: dict[str, int] | None = None) -> str:
+    """SELECT list for names; columns in truncate are cut to that many characters (suffix …)."""
+    exprs = []
+    for n in names:
+        col, n_chars = available[n], (truncate or {}).get(n)
+        if n_chars:
+            exprs.append(f"CASE WHEN length({col}) > {int(n_chars)} THEN substr({col}, 1, {int(n_chars)}) || '…' ELSE {col} END")
+        else:
+            exprs.append(col)
+    return ", ".join(exprs)
+
+
+def _split_tags(value: str | None) -> list[str]:
+    return [t.strip() for t in value.split(",") if t.strip()] if value else []
+
+
+def _json_bytes(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":")).encode()
+
+
+# 列表响应缓存：按 (路径, 规范化查询参数, 当天日期) 缓存编码后的响应，以数据代数 (data_generation) 校验，
+# 入库、清理、重打标等写入后自动失效；ETag 由代数生成，If-None-Match 命中时返回 304
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "256"))
+_RESPONSE_CACHE: OrderedDict[tuple, tuple[str, bytes, dict[str, str]]] = OrderedDict()
+_RESPONSE_CACHE_LOCK = threading.Lock()
+_CACHE_EPOCH = format(time.time_ns(), "x")  # 重启后 ETag 随之变化（代码可能已更新）
+
+
+def _cache_lookup(request: Request | None) -> tuple[tuple | None, str | None, Response | None]:
+    """(cache key, ETag, response to return or None). 304 when If-None-Match matches; the cached body on a hit."""
+    if request is None or RESPONSE_CACHE_SIZE <= 0:
+        return None, None, None
+    # 相对天数筛选随日期变化，日期计入键
+    day = datetime.now().strftime("%Y-%m-%d") + datetime.now(timezone.utc).strftime("/%Y-%m-%d")
+    key = (request.url.path, tuple(sorted(request.query_params.multi_items())), day)
+    with connection() as conn:
+        generation = load_generation(conn.cursor())
+    digest = hashlib.blake2b(repr(key).encode(), digest_size=8).hexdigest()
+    etag = f'"{_CACHE_EPOCH}-{generation}-{digest}"'
+    client_tags = request.headers.get("if-none-match", "")
+    if etag in (t.strip().removeprefix("W/") for t in client_tags.split(",")):
+        return key, etag, Response(status_code=304, headers={"ETag": etag})
+    with _RESPONSE_CACHE_LOCK:
+        hit = _RESPONSE_CACHE.get(key)
+        if hit is not None and hit[0] == etag:
+            _RESPONSE_CACHE.move_to_end(key)
+            return key, etag, Response(hit[1], media_type="application/json", headers=hit[2])
+    return key, etag, None
+
+
+def _cache_store(key: tuple | None, etag: str | None, content, headers: dict[str, str] | None = None):
+    """Encode content as the JSON response, keep it in the LRU cache under key and return it."""
+    if key is None:
+        return Response(_json_bytes(content), media_type="application/json", headers=headers)
+    headers = {**(headers or {}), "ETag": etag}
+    body = _json_bytes(content)
+    with _RESPONSE_CACHE_LOCK:
+        _RESPONSE_CACHE[key] = (etag, body, headers)
+        _RESPONSE_CACHE.move_to_end(key)
+        while len(_RESPONSE_CACHE) > RESPONSE_CACHE_SIZE:
+            _RESPONSE_CACHE.popitem(last=False)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+def _multi_tag_filter(table: str, tags: list[str] | None, mode: str | None) -> tuple[str, list]:
+    """SQL condition (alias p) for multiple tags combined by mode (and/or). Registered tags (TAG_BITS)
+    are checked with bitwise ops on tag_mask; other tags fall back to the join table."""
+    names = list(dict.fromkeys(t.strip() for v in (tags or []) for t in v.split(",") if t.strip()))
+    if not names:
+        return "", []
+    tag_table, id_col, _ = TAG_INDEX[table]
+    mask = tags_to_mask(names)
+    others = [t for t in names if t not in TAG_BITS]
+    if (mode or "or").strip().lower() == "and":
+        conds = [f"(p.tag_mask & {mask}) = {mask}"] if mask else []
+        conds += [f"p.id IN (SELECT {id_col} FROM {tag_table} WHERE tag = ?)"] * len(others)
+        return " AND " + " AND ".join(conds), others
+    conds = [f"(p.tag_mask & {mask}) != 0"] if mask else []
+    if others:
+        conds.append(f"p.id IN (SELECT {id_col} FROM {tag_table} WHERE tag IN ({','.join('?' * len(others))}))")
+    return " AND (" + " OR ".join(conds) + ")", others
 
 
 @app.get("/api/papers")
@@ -69,111 +309,142 @@ def list_papers(
     affiliation: str | None = Query(None, description="Filter by affiliation"),
     keyword: str | None = Query(None, description="Keyword in title/abstract/categories"),
     tag: str | None = Query(None, description="Filter by tag (3DGS, NeRF, 世界模型, etc.)"),
+    tags: list[str] | None = Query(None, description="Filter by multiple tags (repeat or comma-separated), combined by tag_mode"),
+    tag_mode: str | None = Query("or", description="Combine tags with and / or"),
     from_date: str | None = Query(None, description="Start date (YYYY-MM-DD)"),
     to_date: str | None = Query(None, description="End date (YYYY-MM-DD)"),
     min_citations: int | None = Query(None, ge=0, description="Minimum citation count"),
+    sort: str | None = Query(None, description="Sort by: date (default) or relevance (search/keyword/author match rank)"),
+    cursor: str | None = Query(None, description="Page cursor: X-Next-Cursor header of the previous page (same filters)"),
+    fields: str | None = Query(None, description="Comma-separated fields to return (default all), e.g. id,title,published_at,tags"),
+    abstract_chars: int | None = Query(None, ge=1, le=10000, description="Truncate abstracts to this many characters"),
+    request: Request = None,
 ):
-    """List papers with optional filters."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    
-    query = "SELECT * FROM papers WHERE 1=1"
-    params = []
+    """List papers with optional filters. Paged by (published_ts, id); the next page's cursor is returned
+    in the X-Next-Cursor header, absent on the last page. Responses are cached until the data changes (ETag)."""
+    cache_key, etag, cached = _cache_lookup(request)
+    if cached is not None:
+        return cached
+    names = _parse_fields(fields, PAPER_FIELDS)
+    select = _select_list(names, PAPER_FIELDS, {"abstract": abstract_chars} if abstract_chars else None)
+    # search / keyword / author 走 papers_fts（trigram 子串匹配，可按 bm25 相关度排序）；
+    # SQLite 无 FTS5 或词少于 3 字时回退 LIKE
+    fts_match, like_sql, like_params = _split_text_filters("papers", (
+        (search, ("title", "abstract")),
+        (keyword, ("title", "abstract", "categories")),
+        (author, ("authors",)),
+    ))
+    relevance = bool(fts_match) and (sort or "").strip().lower() == "relevance"
+    if relevance:
+        # 按相关度：从全文索引出发（CROSS JOIN 固定连接顺序），按 bm25 排序
+        query = "FROM papers_fts CROSS JOIN papers p ON p.rowid = papers_fts.rowid"
+        conds = ["papers_fts MATCH ?"]
+        params = [fts_match]
+        date_col, id_col = "p.published_ts", "p.id"
+        if tag and tag.strip():
+            query += " JOIN paper_tags pt ON pt.paper_id = p.id"
+            conds.append("pt.tag = ?")
+            params.append(tag.strip())
+    # 有标签时从 paper_tags 的 (tag, published_ts) 索引出发，按日期区间扫描并回表
+    elif tag and tag.strip():
+        query = "FROM paper_tags pt JOIN papers p ON p.id = pt.paper_id"
+        conds = ["pt.tag = ?"]
+        params = [tag.strip()]
+        date_col, id_col = "pt.published_ts", "pt.paper_id"
+    else:
+        query = "FROM papers p"
+        conds = ["1=1"]
+        params = []
+        date_col, id_col = "p.published_ts", "p.id"
+    if fts_match and not relevance:
+        # 子查询只执行一次；直接 JOIN 时全文查询可能对每个候选行重跑
+        conds.append("p.rowid IN (SELECT rowid FROM papers_fts WHERE papers_fts MATCH ?)")
+        params.append(fts_match)
+    query += " WHERE " + " AND ".join(conds)
     
     if category:
-        query += " AND categories LIKE ?"
+        query += " AND p.categories LIKE ?"
         params.append(f"%{category}%")
-    
-    if search:
-        query += " AND (title LIKE ? OR abstract LIKE ?)"
-        params.extend([f"%{search}%", f"%{search}%"])
 
-    if keyword:
-        query += " AND (title LIKE ? OR abstract LIKE ? OR categories LIKE ?)"
-        params.extend([f"%{keyword}%", f"%{keyword}%", f"%{keyword}%"])
-
-    if author:
-        query += " AND authors LIKE ?"
-        params.append(f"%{author}%")
+    query += like_sql
+    params.extend(like_params)
 
     if affiliation:
-        query += " AND affiliations LIKE ?"
+        query += " AND p.affiliations LIKE ?"
         params.append(f"%{affiliation}%")
 
     if source:
-        query += " AND source = ?"
+        query += " AND p.source = ?"
         params.append(source)
 
-    if tag and tag.strip():
-        t = tag.strip()
-        query += " AND (tags = ? OR tags LIKE ? OR tags LIKE ? OR tags LIKE ?)"
-        params.extend([t, f"{t},%", f"%,{t},%", f"%,{t}"])
-
     if min_citations is not None:
-        query += " AND citation_count >= ?"
+        query += " AND p.citation_count >= ?"
         params.append(min_citations)
 
-    from datetime import timedelta, timezone
+    tag_cond, tag_params = _multi_tag_filter("papers", tags, tag_mode)
+    query += tag_cond
+    params.extend(tag_params)
+
     now = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
-    # 使用 YYYY-MM-DD 格式，避免 "2026-02-06"(date only) 与 "2026-02-06T00:00:00" 比较时被错误排除
-    def _date_cutoff(d: int) -> str:
-        return (now - timedelta(days=d)).strftime("%Y-%m-%d") if d > 0 else "1970-01-01"
+    # 按整数 UTC 时间戳比较，不受 published_at 文本格式（日期 / 带时区 / Z 结尾）影响
+    def _date_cutoff(d: int) -> int:
+        return int((now - timedelta(days=d)).timestamp()) if d > 0 else 0
+    windows = None
+    bounded = False  # 有日期下界/上界时无日期的行不会命中，省去末尾的无日期区间
     if not from_date and not to_date:
         if source == "openreview":
             if conference_days and conference_days > 0:
-                query += " AND published_at >= ?"
+                query += f" AND {date_col} >= ?"
                 params.append(_date_cutoff(conference_days))
+                bounded = True
         elif source:
             if days and days > 0:
-                query += " AND published_at >= ?"
+                query += f" AND {date_col} >= ?"
                 params.append(_date_cutoff(days))
+                bounded = True
         else:
             if (days or 0) > 0 or (conference_days or 0) > 0:
                 d_cut = _date_cutoff(days or 0)
                 c_cut = _date_cutoff(conference_days or 0)
-                query += " AND ((source = 'openreview' AND published_at >= ?) OR (COALESCE(source, '') != 'openreview' AND published_at >= ?))"
-                params.extend([c_cut, d_cut])
+                # OpenReview 与其他来源的日期窗口不同：拆成两个区间，各自走 (source, published_ts) / (published_ts)
+                # 索引有序扫描后归并；写成一个 OR 条件时只能全表扫描再排序
+                windows = [
+                    (f"p.source = 'openreview' AND {date_col} >= ?", [c_cut]),
+                    (f"(p.source IS NULL OR p.source != 'openreview') AND {date_col} >= ?", [d_cut]),
+                ]
+                if relevance:
+                    query += f" AND (({windows[0][0]}) OR ({windows[1][0]}))"
+                    params.extend([c_cut, d_cut])
+                    windows = None
 
     if from_date:
-        query += " AND published_at >= ?"
-        params.append(_normalize_date(from_date))
+        query += f" AND {date_col} >= ?"
+        params.append(_date_bound(from_date))
+        bounded = True
 
     if to_date:
-        query += " AND published_at <= ?"
-        params.append(_normalize_date(to_date))
+        query += f" AND {date_col} <= ?"
+        params.append(_date_bound(to_date, end=True))
+        bounded = True
+    if bounded and windows is None:
+        windows = [(f"{date_col} IS NOT NULL", [])]
     
-    query += " ORDER BY published_at DESC LIMIT ?"
-    params.append(limit)
-    
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-    
-    def _tags_list(r):
-        s = r.get("tags") or ""
-        return [t.strip() for t in s.split(",") if t.strip()] if s else []
-
-    return [
-        {
-            "id": r["id"],
-            "title": r["title"],
-            "abstract": r["abstract"],
-            "authors": r["authors"],
-            "categories": r["categories"],
-            "pdf_url": r["pdf_url"],
-            "arxiv_url": r["arxiv_url"],
-            "published_at": r["published_at"],
-            "source": r["source"],
-            "doi": r["doi"],
-            "url": r["url"],
-            "affiliations": r["affiliations"],
-            "keywords": r["keywords"],
-            "venue": r["venue"],
-            "citation_count": r["citation_count"],
-            "tags": _tags_list(dict(r)),
-        }
-        for r in rows
-    ]
+    with connection() as conn:
+        if relevance:
+            after = _decode_cursor(cursor, "relevance")
+            rows, next_cursor = _fetch_ranked_page(conn, select, query, params, f"papers_fts.rank, {date_col} DESC", after, limit)
+        else:
+            after = _decode_cursor(cursor, "date")
+            rows, next_cursor = _fetch_page(conn, select, query, params, "date", (date_col, id_col), after, limit, windows)
+
+    # 每行直接由元组构造输出对象（末尾的排序键不在 names 内，zip 时截去）
+    papers = []
+    for r in rows:
+        item = dict(zip(names, r))
+        if "tags" in item:
+            item["tags"] = _split_tags(item["tags"])
+        papers.append(item)
+    return _cache_store(cache_key, etag, papers, {"X-Next-Cursor": next_cursor} if next_cursor else None)
 
 
 @app.post("/api/refresh")
@@ -185,16 +456,28 @@ def refresh_papers(
     """Trigger crawl to fetch new papers from arXiv, S2, OpenReview. source 可指定仅拉取某源。"""
     count, notifications = fetch_and_store(days=days, tag=tag, source=source)
     deleted = cleanup_papers_without_business_tags(openreview_only=True)
-    _invalidate_tags_cache()
-    return {"status": "ok", "papers_added": count, "notifications_added": notifications, "papers_deleted": deleted}
+    return {"status": "ok", "papers_added": count, "notifications_added": notifications, "papers_deleted": deleted, "hosts": host_metrics()}
 
 
 @app.post("/api/backfill-tags")
-def backfill_tags(force: bool = Query(False, description="If true, re-tag all papers")):
-    """Manually backfill tags. Use if tag filter returns empty."""
-    n = backfill_paper_tags(force=force)
-    _invalidate_tags_cache()
-    return {"status": "ok", "papers_updated": n}
+def backfill_tags(
+    force: bool = Query(False, description="If true, re-tag all papers"),
+    posts: bool = Query(False, description="If true, also re-tag community/code/company posts"),
+):
+    """Manually backfill tags. Use if tag filter returns empty. Large re-tags run on all CPU cores.
+    force=false first applies keyword-table edits incrementally (only rows containing changed keywords)."""
+    rules = {}
+    n = m = 0
+    if not force:
+        rules["papers"] = sync_paper_tag_rules()
+        n += rules["papers"]["updated"]
+        if posts:
+            rules["posts"] = sync_post_tag_rules()
+            m += rules["posts"]["updated"]
+    n += backfill_paper_tags(force=force)
+    if posts:
+        m += backfill_post_tags(force=force)
+    return {"status": "ok", "papers_updated": n, "posts_updated": m, "tag_rules": {k: v["mode"] for k, v in rules.items()}}
 
 
 @app.post("/api/cleanup-papers")
@@ -203,7 +486,6 @@ def cleanup_papers(
 ):
     """Delete papers without business tags. When openreview_only=true, also delete OpenReview papers that have only conference tags (no research direction)."""
     n = cleanup_papers_without_business_tags(openreview_only=openreview_only)
-    _invalidate_tags_cache()
     return {"status": "ok", "papers_deleted": n}
 
 
@@ -219,15 +501,15 @@ def cleanup_by_retention(
         code_keep_days=code_days,
         community_keep_days=community_days,
     )
-    _invalidate_tags_cache()
     return {"status": "ok", **result}
 
 
 @app.post("/api/cleanup/vacuum")
-def cleanup_vacuum():
-    """Reclaim disk space after deletes. Run after cleanup."""
-    run_vacuum()
-    return {"status": "ok"}
+def cleanup_vacuum(
+    max_pages: int = Query(16384, ge=1, le=1048576, description="Max free pages to reclaim in this call (incremental vacuum)"),
+):
+    """Reclaim disk space after deletes in bounded incremental steps. Run after cleanup; repeat while pages_left > 0."""
+    return {"status": "ok", **run_vacuum(max_pages=max_pages)}
 
 
 @app.get("/api/posts")
@@ -238,87 +520,103 @@ def list_posts(
     company: str | None = Query(None, description="Filter by company name (for source=company)"),
     direction: str | None = Query(None, description="Filter by direction (3d_gen/video_world/3d_design/llm/embodied)"),
     tag: str | None = Query(None, description="Filter by tag (3DGS, 大模型, etc.)"),
+    tags: list[str] | None = Query(None, description="Filter by multiple tags (repeat or comma-separated), combined by tag_mode"),
+    tag_mode: str | None = Query("or", description="Combine tags with and / or"),
     days: int = Query(365, ge=1, le=365, description="Filter by days (default 365=all)"),
     limit: int = Query(50, ge=1, le=200),
-    sort: str | None = Query(None, description="Sort by: created (default) or star (score, GitHub stars / HF downloads)"),
+    sort: str | None = Query(None, description="Sort by: created (default), star (score, GitHub stars / HF downloads) or relevance (search/domain match rank)"),
+    cursor: str | None = Query(None, description="Page cursor: X-Next-Cursor header of the previous page (same filters and sort)"),
+    fields: str | None = Query(None, description="Comma-separated fields to return (default all), e.g. id,title,url,created_at"),
+    request: Request = None,
 ):
-    """List community and company posts."""
-    conn = get_connection()
-    cursor = conn.cursor()
-    query = "SELECT * FROM posts WHERE 1=1"
-    params = []
+    """List community and company posts. Paged by (created_ts, id), or (score, id) when sort=star; the next
+    page's cursor is returned in the X-Next-Cursor header, absent on the last page. Responses are cached until
+    the data changes (ETag)."""
+    cache_key, etag, cached = _cache_lookup(request)
+    if cached is not None:
+        return cached
+    names = _parse_fields(fields, POST_FIELDS)
+    select = _select_list(names, POST_FIELDS)
+    # search / domain 走 posts_fts（trigram 按字符切分，中文公司新闻无需分词）；无 FTS5 或词少于 3 字时回退 LIKE
+    fts_match, like_sql, like_params = _split_text_filters("posts", (
+        (search, ("title", "summary")),
+        (domain, ("title", "summary")),
+    ))
+    sort = (sort or "").strip().lower()
+    relevance = bool(fts_match) and sort == "relevance"
+    if relevance:
+        query = "FROM posts_fts CROSS JOIN posts p ON p.rowid = posts_fts.rowid"
+        conds = ["posts_fts MATCH ?"]
+        params = [fts_match]
+        date_col, id_col = "p.created_ts", "p.id"
+        if tag and tag.strip():
+            query += " JOIN post_tags pt ON pt.post_id = p.id"
+            conds.append("pt.tag = ?")
+            params.append(tag.strip())
+    elif tag and tag.strip():
+        query = "FROM post_tags pt JOIN posts p ON p.id = pt.post_id"
+        conds = ["pt.tag = ?"]
+        params = [tag.strip()]
+        date_col, id_col = "pt.created_ts", "pt.post_id"
+    else:
+        query = "FROM posts p"
+        conds = ["1=1"]
+        params = []
+        date_col, id_col = "p.created_ts", "p.id"
+    if fts_match and not relevance:
+        conds.append("p.rowid IN (SELECT rowid FROM posts_fts WHERE posts_fts MATCH ?)")
+        params.append(fts_match)
+    query += " WHERE " + " AND ".join(conds)
     if source:
         if isinstance(source, str):
-            query += " AND source = ?"
+            query += " AND p.source = ?"
             params.append(source)
         else:
             placeholders = ",".join("?" * len(source))
-            query += f" AND source IN ({placeholders})"
+            query += f" AND p.source IN ({placeholders})"
             params.extend(source)
     if company:
-        query += " AND source = 'company' AND channel = ?"
+        query += " AND p.source = 'company' AND p.channel = ?"
         params.append(company)
     if direction and direction in COMPANY_DIRECTIONS:
         companies = COMPANY_DIRECTIONS[direction]
         placeholders = ",".join("?" * len(companies))
-        query += f" AND source = 'company' AND channel IN ({placeholders})"
+        query += f" AND p.source = 'company' AND p.channel IN ({placeholders})"
         params.extend(companies)
-    if search:
-        query += " AND (title LIKE ? OR summary LIKE ?)"
-        params.extend([f"%{search}%", f"%{search}%"])
-    if domain:
-        query += " AND (title LIKE ? OR summary LIKE ?)"
-        params.extend([f"%{domain}%", f"%{domain}%"])
-    if tag and tag.strip():
-        t = tag.strip()
-        query += " AND (tags = ? OR tags LIKE ? OR tags LIKE ? OR tags LIKE ?)"
-        params.extend([t, f"{t},%", f"%,{t},%", f"%,{t}"])
-    # 社区动态只显示 2025 年以来的
-    query += " AND (created_at >= ? OR created_at IS NULL OR created_at = '')"
-    params.append("2025-01-01")
+    query += like_sql
+    params.extend(like_params)
+    tag_cond, tag_params = _multi_tag_filter("posts", tags, tag_mode)
+    query += tag_cond
+    params.extend(tag_params)
+    # 社区动态只显示 2025 年以来的；无日期的动态始终保留（按时间排序时列在最后）
+    since = to_epoch("2025-01-01")
     if days and days < 365:
-        cutoff = (datetime.now() - timedelta(days=days)).isoformat()[:10]
-        query += " AND (created_at >= ? OR created_at IS NULL OR created_at = '')"
-        params.append(cutoff)
-    if sort and sort.strip().lower() == "star":
-        query += " ORDER BY score DESC, created_at DESC LIMIT ?"
-    else:
-        query += " ORDER BY created_at DESC, score DESC LIMIT ?"
-    params.append(limit)
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
-
-    def _clean_post(r):
-        title = strip_html(r["title"] or "") or r["title"] or ""
-        summary = strip_html(r["summary"] or "") or r["summary"] or ""
-        author = (r["author"] or "").strip()
-        # 公司新闻：去掉 summary 中重复的来源信息
-        if r["source"] == "company" and author:
-            if summary.startswith(f"{author} - "):
-                summary = summary[len(author) + 3 :].strip()
-            # 去掉末尾的 " 来源"（Google News 格式常在 summary 末尾带来源）
-            for suffix in [f"  {author}", f" {author}", author]:
-                if summary.endswith(suffix):
-                    summary = summary[:-len(suffix)].strip()
-                    break
-        tags_str = r.get("tags") or ""
-        tags_list = [t.strip() for t in tags_str.split(",") if t.strip()] if tags_str else []
-        return {
-            "id": r["id"],
-            "source": r["source"],
-            "title": title,
-            "url": r["url"],
-            "author": author,
-            "score": r["score"],
-            "comment_count": r["comment_count"],
-            "summary": summary,
-            "channel": r["channel"],
-            "tags": tags_list,
-            "created_at": r["created_at"],
-        }
-
-    return [_clean_post(dict(r)) for r in rows]
+        since = max(since, to_epoch((datetime.now() - timedelta(days=days)).isoformat()[:10]))
+    dated = (f"{date_col} >= ?", [since])
+    undated = (f"{date_col} IS NULL", [])
+    if relevance or sort == "star":
+        query += f" AND ({dated[0]} OR {undated[0]})"
+        params.append(since)
+    with connection() as conn:
+        if relevance:
+            after = _decode_cursor(cursor, "relevance")
+            rows, next_cursor = _fetch_ranked_page(conn, select, query, params, f"posts_fts.rank, {date_col} DESC", after, limit)
+        elif sort == "star":
+            after = _decode_cursor(cursor, "star")
+            rows, next_cursor = _fetch_page(conn, select, query, params, "star", ("p.score", id_col), after, limit)
+        else:
+            after = _decode_cursor(cursor, "created")
+            keys = (date_col, id_col)
+            rows, next_cursor = _fetch_page(conn, select, query, params, "created", keys, after, limit, dated, undated)
+
+    # 文本已在入库时清洗（ingest.clean_post_text），直接输出存储的列
+    posts = []
+    for r in rows:
+        item = dict(zip(names, r))
+        if "tags" in item:
+            item["tags"] = _split_tags(item["tags"])
+        posts.append(item)
+    return _cache_store(cache_key, etag, posts, {"X-Next-Cursor": next_cursor} if next_cursor else None)
 
 
 @app.post("/api/refresh-posts")
@@ -329,7 +627,6 @@ def refresh_posts(
 ):
     """Trigger crawl to fetch community posts (HN, Reddit, YouTube). Supports tag, source, days filters."""
     count, errors = fetch_and_store_posts(days=days, tag=tag, source=source)
-    _invalidate_tags_cache()
     hint = None
     if errors:
         hint = "抓取错误: " + "; ".join(errors[:3]) + ("…" if len(errors) > 3 else "")
@@ -344,7 +641,7 @@ def refresh_posts(
             hint = "Reddit 未返回数据。若代理已配置仍失败，请查看后端控制台日志中的具体错误（如连接超时、429 限流等）"
         elif src == "hn":
             hint = "HN 未返回数据，请检查网络或尝试设置 HTTPS_PROXY 代理"
-    return {"status": "ok", "posts_added": count, "hint": hint}
+    return {"status": "ok", "posts_added": count, "hint": hint, "hosts": host_metrics()}
 
 
 @app.post("/api/refresh-code")
@@ -354,53 +651,47 @@ def refresh_code_posts(
 ):
     """Trigger crawl to fetch code posts (GitHub, Hugging Face). Supports 选定标签->选定时间 抓取."""
     count = fetch_and_store_code_posts(days=days, tag=tag)
-    _invalidate_tags_cache()
-    return {"status": "ok", "posts_added": count}
+    return {"status": "ok", "posts_added": count, "hosts": host_metrics()}
 
 
 @app.post("/api/refresh-company-posts")
 def refresh_company_posts(days: int = Query(90, ge=1, le=365)):
     """Trigger crawl to fetch company product updates. Only last N days (default 90 = 3 months)."""
     count, errors = fetch_and_store_company_posts(days=days)
-    _invalidate_tags_cache()
-    return {"status": "ok", "posts_added": count, "errors": errors}
-
+    return {"status": "ok", "posts_added": count, "errors": errors, "hosts": host_metrics()}
 
-_TAGS_CACHE: list[str] | None = None
-_TAGS_CACHE_AT: float = 0
-_TAGS_CACHE_TTL = 300  # 5 minutes
 
-
-def _invalidate_tags_cache():
-    global _TAGS_CACHE
-    _TAGS_CACHE = None
+@app.get("/api/tags")
+def list_tags(
+    scope: str | None = Query(None, description="papers or posts; omit for both"),
+    source: str | None = Query(None, description="Filter by source (arxiv/openreview/hn/company, etc.)"),
+):
+    """Tags with row counts for filter dropdowns and facets, read from the tag_counts table."""
+    with connection() as conn:
+        counts = load_tag_counts(conn.cursor(), scope, source)
+    return [{"tag": t, "count": counts[t]} for t in sorted(counts)]
 
 
-@app.get("/api/tags")
-def list_tags():
-    """Get all unique tags from papers and posts for filter dropdown. Cached 5 min."""
-    global _TAGS_CACHE, _TAGS_CACHE_AT
-    now = time()
-    if _TAGS_CACHE is not None and (now - _TAGS_CACHE_AT) < _TAGS_CACHE_TTL:
-        return _TAGS_CACHE
-    conn = get_connection()
-    cursor = conn.cursor()
-    tags = set()
-    cursor.execute("SELECT tags FROM papers WHERE tags IS NOT NULL AND tags != ''")
-    for row in cursor.fetchall():
-        for t in (row["tags"] or "").split(","):
-            if t.strip():
-                tags.add(t.strip())
-    cursor.execute("SELECT tags FROM posts WHERE tags IS NOT NULL AND tags != ''")
-    for row in cursor.fetchall():
-        for t in (row["tags"] or "").split(","):
-            if t.strip():
-                tags.add(t.strip())
-    conn.close()
-    result = sorted(tags)
-    _TAGS_CACHE = result
-    _TAGS_CACHE_AT = now
-    return result
+@app.get("/api/tag-counts")
+def tag_counts(
+    scope: str = Query("papers", description="papers or posts"),
+    source: str | None = Query(None, description="Filter by source"),
+    days: int | None = Query(None, ge=1, le=365, description="Only rows from last N days"),
+):
+    """Per-tag counts of the registered tags (3DGS, CVPR, HN, etc.), computed from tag_mask in one pass."""
+    if scope not in TAG_INDEX:
+        return {"status": "error", "message": "scope must be papers or posts"}
+    ts_col = EPOCH_COLUMNS[scope][1]
+    conds, params = [], []
+    if source:
+        conds.append("source = ?")
+        params.append(source)
+    if days:
+        conds.append(f"{ts_col} >= ?")
+        params.append(to_epoch((datetime.now() - timedelta(days=days)).isoformat()[:10]))
+    with connection() as conn:
+        counts = count_tags_by_mask(conn.cursor(), scope, " AND ".join(conds), params)
+    return {t: n for t, n in counts.items() if n}
 
 
 @app.get("/api/company-config")
@@ -412,11 +703,10 @@ def get_company_config():
 
 @app.get("/api/subscriptions")
 def list_subscriptions():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, type, value, active, created_at FROM subscriptions ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, type, value, active, created_at FROM subscriptions ORDER BY created_at DESC")
+        rows = cursor.fetchall()
     return [dict(r) for r in rows]
 
 
@@ -427,15 +717,13 @@ def create_subscription(payload: dict = Body(...)):
     active = 1 if payload.get("active", True) else 0
     if not sub_type or not value:
         return {"status": "error", "message": "type and value required"}
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO subscriptions (type, value, active) VALUES (?, ?, ?)",
-        (sub_type, value, active),
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO subscriptions (type, value, active) VALUES (?, ?, ?)",
+            (sub_type, value, active),
+        )
+        new_id = cursor.lastrowid
     return {"status": "ok", "id": new_id}
 
 
@@ -444,31 +732,26 @@ def update_subscription(sub_id: int, payload: dict = Body(...)):
     active = payload.get("active")
     if active is None:
         return {"status": "error", "message": "active required"}
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE subscriptions SET active = ? WHERE id = ?", (1 if active else 0, sub_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE subscriptions SET active = ? WHERE id = ?", (1 if active else 0, sub_id))
     return {"status": "ok"}
 
 
 @app.delete("/api/subscriptions/{sub_id}")
 def delete_subscription(sub_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM subscriptions WHERE id = ?", (sub_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM subscriptions WHERE id = ?", (sub_id,))
     return {"status": "ok"}
 
 
 @app.get("/api/s2-queries")
 def list_s2_queries():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, query, active, created_at FROM s2_queries ORDER BY created_at DESC")
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, query, active, created_at FROM s2_queries ORDER BY created_at DESC")
+        rows = cursor.fetchall()
     return [dict(r) for r in rows]
 
 
@@ -478,15 +761,13 @@ def create_s2_query(payload: dict = Body(...)):
     active = 1 if payload.get("active", True) else 0
     if not query:
         return {"status": "error", "message": "query required"}
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO s2_queries (query, active) VALUES (?, ?)",
-        (query, active),
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO s2_queries (query, active) VALUES (?, ?)",
+            (query, active),
+        )
+        new_id = cursor.lastrowid
     return {"status": "ok", "id": new_id}
 
 
@@ -495,33 +776,28 @@ def update_s2_query(query_id: int, payload: dict = Body(...)):
     active = payload.get("active")
     if active is None:
         return {"status": "error", "message": "active required"}
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE s2_queries SET active = ? WHERE id = ?", (1 if active else 0, query_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE s2_queries SET active = ? WHERE id = ?", (1 if active else 0, query_id))
     return {"status": "ok"}
 
 
 @app.delete("/api/s2-queries/{query_id}")
 def delete_s2_query(query_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM s2_queries WHERE id = ?", (query_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM s2_queries WHERE id = ?", (query_id,))
     return {"status": "ok"}
 
 
 @app.get("/api/crawl-keywords")
 def list_crawl_keywords():
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, keyword, scope, active, created_at FROM crawl_keywords ORDER BY created_at DESC"
-    )
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, keyword, scope, active, created_at FROM crawl_keywords ORDER BY created_at DESC"
+        )
+        rows = cursor.fetchall()
     return [dict(r) for r in rows]
 
 
@@ -534,15 +810,13 @@ def create_crawl_keyword(payload: dict = Body(...)):
         return {"status": "error", "message": "keyword required"}
     if scope not in ("papers", "community", "company", "all"):
         scope = "all"
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO crawl_keywords (keyword, scope, active) VALUES (?, ?, ?)",
-        (keyword, scope, active),
-    )
-    conn.commit()
-    new_id = cursor.lastrowid
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "INSERT INTO crawl_keywords (keyword, scope, active) VALUES (?, ?, ?)",
+            (keyword, scope, active),
+        )
+        new_id = cursor.lastrowid
     return {"status": "ok", "id": new_id}
 
 
@@ -551,21 +825,17 @@ def update_crawl_keyword(kw_id: int, payload: dict = Body(...)):
     active = payload.get("active")
     if active is None:
         return {"status": "error", "message": "active required"}
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE crawl_keywords SET active = ? WHERE id = ?", (1 if active else 0, kw_id))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE crawl_keywords SET active = ? WHERE id = ?", (1 if active else 0, kw_id))
     return {"status": "ok"}
 
 
 @app.delete("/api/crawl-keywords/{kw_id}")
 def delete_crawl_keyword(kw_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM crawl_keywords WHERE id = ?", (kw_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM crawl_keywords WHERE id = ?", (kw_id,))
     return {"status": "ok"}
 
 
@@ -574,33 +844,30 @@ def list_notifications(
     unread: bool | None = Query(None),
     limit: int = Query(20, ge=1, le=200),
 ):
-    conn = get_connection()
-    cursor = conn.cursor()
-    query = """
-        SELECT n.id, n.paper_id, n.subscription_id, n.reason, n.read, n.created_at,
-               p.title, p.authors, p.arxiv_url, p.published_at, p.source
-        FROM notifications n
-        LEFT JOIN papers p ON p.id = n.paper_id
-        WHERE 1=1
-    """
-    params = []
-    if unread is True:
-        query += " AND n.read = 0"
-    query += " ORDER BY n.created_at DESC LIMIT ?"
-    params.append(limit)
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        query = """
+            SELECT n.id, n.paper_id, n.subscription_id, n.reason, n.read, n.created_at,
+                   p.title, p.authors, p.arxiv_url, p.published_at, p.source
+            FROM notifications n
+            LEFT JOIN papers p ON p.id = n.paper_id
+            WHERE 1=1
+        """
+        params = []
+        if unread is True:
+            query += " AND n.read = 0"
+        query += " ORDER BY n.created_at DESC LIMIT ?"
+        params.append(limit)
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
     return [dict(r) for r in rows]
 
 
 @app.patch("/api/notifications/{note_id}/read")
 def mark_notification_read(note_id: int):
-    conn = get_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE notifications SET read = 1 WHERE id = ?", (note_id,))
-    conn.commit()
-    conn.close()
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("UPDATE notifications SET read = 1 WHERE id = ?", (note_id,))
     return {"status": "ok"}
 
 
@@ -613,17 +880,16 @@ def health():
 def debug_papers_dates():
     """Diagnostic: max/min published_at, server time, latest 5 papers."""
     from datetime import datetime, timezone
-    conn = get_connection()
-    cur = conn.cursor()
-    cur.execute("SELECT MAX(published_at), MIN(published_at), COUNT(*) FROM papers")
-    row = cur.fetchone()
-    mx, mn, cnt = (row[0], row[1], row[2]) if row else (None, None, 0)
-    cur.execute("SELECT id, title, published_at, source FROM papers ORDER BY published_at DESC LIMIT 5")
-    rows = cur.fetchall()
-    latest = [{"id": r[0], "title": (r[1] or "")[:60], "published_at": r[2], "source": r[3]} for r in rows]
-    cur.execute("SELECT COUNT(*) FROM papers WHERE published_at >= ?", ("2026-02-05",))
-    after_feb5 = cur.fetchone()[0]
-    conn.close()
+    with connection() as conn:
+        cur = conn.cursor()
+        cur.execute("SELECT MAX(published_at), MIN(published_at), COUNT(*) FROM papers")
+        row = cur.fetchone()
+        mx, mn, cnt = (row[0], row[1], row[2]) if row else (None, None, 0)
+        cur.execute("SELECT id, title, published_at, source FROM papers ORDER BY published_at DESC LIMIT 5")
+        rows = cur.fetchall()
+        latest = [{"id": r[0], "title": (r[1] or "")[:60], "published_at": r[2], "source": r[3]} for r in rows]
+        cur.execute("SELECT COUNT(*) FROM papers WHERE published_at >= ?", ("2026-02-05",))
+        after_feb5 = cur.fetchone()[0]
     now_utc = datetime.now(timezone.utc)
     now_local = datetime.now()
     return {
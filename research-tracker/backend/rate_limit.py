@@ -0,0 +1,182 @@
+"""Per-host token-bucket rate limiter shared by every crawler request (applied in http_client.http_get).
+
+A limited host's bucket refills at its rate (requests/second) up to its burst; each request takes one token
+and waits when none is left. Throttling responses (429/503, or a quota header reporting 0 remaining) pause
+the host for Retry-After / the quota reset and halve its rate; later successes raise it again step by step
+(up to the configured rate), so pacing follows the upstream's real allowance instead of fixed sleeps. A host
+without a configured rate is not paced until it is first throttled, then starts from its recent success rate."""
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+# 主机 -> (每秒请求数, 突发量)；未列出的主机不预先限速，仅在被限流时暂停。HTTP_HOST_RATES 可覆盖，
+# 格式 "host=rate[:burst],..."，如 "export.arxiv.org=0.5,api.github.com=0.5:10"
+HOST_RATES: dict[str, tuple[float, int]] = {
+    "export.arxiv.org": (1 / 3, 1),  # arXiv 约定每 3 秒 1 次
+    "api.semanticscholar.org": (1.0, 4),  # 未认证共享配额，易 429
+    # 搜索接口未认证 10 次/分钟，带 GITHUB_TOKEN 时 30 次/分钟
+    "api.github.com": ((30 if os.getenv("GITHUB_TOKEN", "").strip() else 10) / 60, 5),
+    "www.googleapis.com": (1.0, 4),  # YouTube 按日配额计费，避免突发浪费
+    "hn.algolia.com": (2.5, 10),  # 10000 次/小时
+    "www.reddit.com": (0.5, 2),  # 未认证配额很低，另按 x-ratelimit 头暂停
+}
+# 被限流后等待超过该秒数则不再重试，直接返回限流响应（由调用方按失败处理）
+HTTP_RETRY_MAX_WAIT = float(os.getenv("HTTP_RETRY_MAX_WAIT", "60"))
+# 无 Retry-After 时的退避基数（秒），连续限流时翻倍
+BACKOFF_BASE = 2.0
+BACKOFF_MAX = 300.0
+# 限流后速率最低降到配置值的 1/8；每次成功按 5% 回升（配置了速率的主机不超过配置值）
+MIN_RATE_FACTOR = 1 / 8
+MIN_RATE = 0.05
+RECOVER_STEP = 0.05
+# 未配置速率的主机：按最近这么多次成功请求估计首次被限流前的速率
+RATE_WINDOW = 20
+
+
+def _parse_rates(spec: str) -> dict[str, tuple[float, int]]:
+    rates = {}
+    for item in spec.split(","):
+        host, sep, value = item.partition("=")
+        if not sep or not host.strip():
+            continue
+        rate, _, burst = value.partition(":")
+        try:
+            rates[host.strip().lower()] = (float(rate), max(1, int(burst or 1)))
+        except ValueError:
+            print(f"[rate_limit] 忽略无效的 HTTP_HOST_RATES 项: {item!r}")
+    return rates
+
+
+HOST_RATES.update(_parse_rates(os.getenv("HTTP_HOST_RATES", "")))
+
+
+def _retry_after(value: str | None) -> float | None:
+    """Seconds from a Retry-After header (delta-seconds or HTTP-date), None if absent/invalid."""
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        dt = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return max(0.0, (dt - datetime.now(timezone.utc)).total_seconds())
+
+
+def _quota_reset(headers) -> float | None:
+    """Seconds until the quota resets when X-RateLimit-Remaining reports none left (GitHub 为 epoch 秒，Reddit 为剩余秒数)."""
+    remaining = headers.get("x-ratelimit-remaining")
+    reset = headers.get("x-ratelimit-reset")
+    if remaining is None or reset is None:
+        return None
+    try:
+        if float(remaining) >= 1:
+            return None
+        reset = float(reset)
+    except ValueError:
+        return None
+    if reset > 1e9:
+        reset -= time.time()
+    return max(1.0, reset)
+
+
+class HostLimiter:
+    """Token bucket of one host plus its pause state. rate None = not paced (yet); max_rate None = no cap."""
+
+    def __init__(self, host: str, rate: float | None = None, burst: int = 1):
+        self.host = host
+        self.max_rate = rate
+        self.rate = rate
+        self.burst = burst
+        self.throttled = 0
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._strikes = 0
+        self._last_cut = 0.0
+        self._recent: deque[float] = deque(maxlen=RATE_WINDOW)
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Block until the host is not paused and a token is available, then take it. Returns the send time
+        to pass to observe()."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                wait = self._paused_until - now
+                if wait <= 0:
+                    if self.rate is None:
+                        return now
+                    self._tokens = min(self.burst, self._tokens + max(0.0, now - self._updated) * self.rate)
+                    self._updated = max(self._updated, now)
+                    if self._tokens >= 1:
+                        self._tokens -= 1
+                        return now
+                    wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    def observe(self, response, sent_at: float) -> float | None:
+        """Update from a response to a request sent at sent_at. Returns the pause in seconds if the request was
+        throttled (worth retrying after that delay), else None. The rate is cut at most once per round: throttles
+        of requests sent before the last cut were caused by the old rate."""
+        status = response.status_code
+        quota_wait = _quota_reset(response.headers)
+        throttled = status in (429, 503) or (status == 403 and quota_wait is not None)
+        with self._lock:
+            if not throttled:
+                self._strikes = 0
+                if self.rate is None:
+                    self._recent.append(time.monotonic())
+                else:
+                    self.rate *= 1 + RECOVER_STEP
+                    if self.max_rate is not None:
+                        self.rate = min(self.rate, self.max_rate)
+                if quota_wait is not None:
+                    # 配额已用完（本次仍成功）：暂停到重置时刻
+                    self._pause(time.monotonic() + quota_wait)
+                return None
+            self.throttled += 1
+            self._strikes += 1
+            wait = _retry_after(response.headers.get("Retry-After"))
+            if wait is None:
+                wait = quota_wait if quota_wait is not None else min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (self._strikes - 1))
+            if sent_at < self._last_cut:
+                self._pause(time.monotonic() + wait)
+                return wait
+            self._last_cut = time.monotonic()
+            if self.rate is None:
+                # 未配置速率：从最近的成功速率起步（下面再减半），此后逐步回升试探
+                span = max(1.0, time.monotonic() - self._recent[0]) if self._recent else 1.0
+                self.rate = max(1.0, len(self._recent)) / span
+                self.burst = 1
+            floor = self.max_rate * MIN_RATE_FACTOR if self.max_rate is not None else MIN_RATE
+            self.rate = max(floor, self.rate / 2)
+            self._pause(time.monotonic() + wait)
+            return wait
+
+    def _pause(self, until: float) -> None:
+        # 暂停期间不积攒令牌，恢复后按当前速率重新起步
+        self._paused_until = max(self._paused_until, until)
+        self._tokens = 0.0
+        self._updated = self._paused_until
+
+
+_limiters: dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(host: str) -> HostLimiter:
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            rate, burst = HOST_RATES.get(host, (None, 1))
+            limiter = _limiters[host] = HostLimiter(host, rate, burst)
+        return limiter
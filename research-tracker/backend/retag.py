@@ -0,0 +1,198 @@
+"""Re-tagging of stored papers/posts: chunked backfill and incremental re-tag on keyword-table changes."""
+import json
+import time
+from typing import Callable, Iterable, Iterator
+
+from database import connection, has_fts, index_tags, iter_table_chunks, load_valid_tag_versions
+from tagging import (
+    TAG_BATCH_SIZE,
+    TAG_WORKERS,
+    diff_tag_rules,
+    map_tag_batches,
+    tag_input_hash,
+    tags_to_str,
+)
+
+# 关键词匹配所用文本列（与 tag_paper / tag_post 的 combined 一致）
+KEYWORD_TEXT_COLUMNS: dict[str, tuple[str, ...]] = {
+    "papers": ("title", "abstract", "categories", "keywords"),
+    "posts": ("title", "summary"),
+}
+
+
+def _iter_rowid_chunks(cursor, table: str, columns: str, rowids: list[int], chunk_size: int) -> Iterator[list]:
+    """Yield rows for the given rowids, chunk_size at a time."""
+    step = min(chunk_size, 500)  # 兼容 SQLITE_MAX_VARIABLE_NUMBER=999 的旧版本
+    for i in range(0, len(rowids), step):
+        chunk = rowids[i : i + step]
+        placeholders = ",".join("?" * len(chunk))
+        cursor.execute(f"SELECT rowid AS _rowid, {columns} FROM {table} WHERE rowid IN ({placeholders})", chunk)
+        rows = cursor.fetchall()
+        if rows:
+            yield rows
+
+
+def retag_table(
+    table: str,
+    tag_columns: tuple[str, ...],
+    batch_fn: Callable[[list], list[list[str]]],
+    rules_version: str,
+    force: bool = False,
+    workers: int | None = None,
+    rowids: Iterable[int] | None = None,
+) -> int:
+    """Re-tag rows of papers/posts in chunks. force=False only touches NULL/empty tags.
+    rowids: restrict to these rows (incremental re-tag); None = whole table.
+    Rows are streamed by rowid; rows whose tag_hash matches and whose tag_version is still valid
+    are skipped. The rest are tagged by batch_fn (optionally in a process pool) and written back
+    with one executemany per chunk. Returns count updated."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        where = "" if force else "tags IS NULL OR tags = ''"
+        valid_versions = load_valid_tag_versions(cursor, table, rules_version)
+        if rowids is not None:
+            rowids = sorted(set(rowids))
+            total = len(rowids)
+        else:
+            cursor.execute(f"SELECT COUNT(*) FROM {table}" + (f" WHERE {where}" if where else ""))
+            total = cursor.fetchone()[0]
+        workers = TAG_WORKERS if workers is None else workers
+        if total <= TAG_BATCH_SIZE:
+            workers = 1  # 小批量不值得启动进程池
+        skipped = 0
+
+        def _batches():
+            nonlocal skipped
+            columns = ", ".join(("id", "tag_hash", "tag_version") + tag_columns)
+            if rowids is not None:
+                chunks = _iter_rowid_chunks(cursor, table, columns, rowids, TAG_BATCH_SIZE)
+            else:
+                chunks = iter_table_chunks(cursor, table, columns, where, TAG_BATCH_SIZE)
+            for rows in chunks:
+                keys, payloads = [], []
+                for r in rows:
+                    payload = tuple(r[c] for c in tag_columns)
+                    h = tag_input_hash(payload)
+                    if r["tag_hash"] == h and r["tag_version"] in valid_versions:
+                        skipped += 1
+                        continue
+                    keys.append((r["id"], h))
+                    payloads.append(payload)
+                if keys:
+                    yield keys, payloads
+
+        start = time.perf_counter()
+        updated = 0
+        for keys, tags_lists in map_tag_batches(batch_fn, _batches(), workers):
+            rows = [(tags_to_str(t), h, rules_version, i) for (i, h), t in zip(keys, tags_lists)]
+            conn.executemany(f"UPDATE {table} SET tags = ?, tag_hash = ?, tag_version = ? WHERE id = ?", rows)
+            index_tags(conn.cursor(), table, [(i, tags) for tags, _, _, i in rows])
+            conn.commit()  # 每批提交，避免长时间持有写锁
+            updated += len(keys)
+    if updated or skipped:
+        elapsed = time.perf_counter() - start
+        print(
+            f"[retag] {table}: {updated} rows re-tagged, {skipped} unchanged skipped in {elapsed:.1f}s "
+            f"({(updated + skipped) / max(elapsed, 1e-6):.0f} rows/s, workers={workers})"
+        )
+    return updated
+
+
+def find_keyword_candidates(table: str, keywords: Iterable[str]) -> set[int]:
+    """Rowids of rows whose tag text may contain any of keywords (lowercased substrings). A superset:
+    candidates are re-tagged in full. Uses the trigram index when available; keywords whose longest
+    whitespace-free piece is shorter than 3 characters fall back to one chunked scan."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        fts = f"{table}_fts" if has_fts(cursor, table) else None
+        rowids: set[int] = set()
+        scan: list[str] = []
+        for kw in keywords:
+            # 关键词跨字段拼接处的空格命中时，其中每段无空白片段必然完整落在某一字段内
+            piece = max(kw.split(), key=len, default="")
+            if fts and len(piece) >= 3:
+                cursor.execute(f"SELECT rowid FROM {fts} WHERE {fts} MATCH ?", ('"' + piece.replace('"', '""') + '"',))
+                rowids.update(r[0] for r in cursor.fetchall())
+            else:
+                scan.append(kw)
+        if scan:
+            text_columns = KEYWORD_TEXT_COLUMNS[table]
+            for rows in iter_table_chunks(cursor, table, ", ".join(text_columns), chunk_size=TAG_BATCH_SIZE):
+                for r in rows:
+                    text = " ".join(r[c] or "" for c in text_columns).lower()
+                    if any(k in text for k in scan):
+                        rowids.add(r["_rowid"])
+    return rowids
+
+
+def mark_tag_rules_applied(
+    scope: str,
+    version: str,
+    snapshot: dict,
+    previous: str | None = None,
+) -> None:
+    """Record version as the current rule set for scope. previous: version whose rows stay valid under it
+    (set after an incremental re-tag)."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT COALESCE(MAX(applied_seq), 0) + 1 FROM tag_rules WHERE scope = ?", (scope,))
+        seq = cursor.fetchone()[0]
+        # 当前版本此后会产生新行，不再等价于其他版本
+        cursor.execute("""
+            INSERT INTO tag_rules (scope, version, snapshot, equivalent_to, applied_seq)
+            VALUES (?, ?, ?, NULL, ?)
+            ON CONFLICT(scope, version) DO UPDATE SET snapshot = excluded.snapshot, equivalent_to = NULL, applied_seq = excluded.applied_seq
+        """, (scope, version, json.dumps(snapshot, ensure_ascii=False), seq))
+        if previous and previous != version:
+            cursor.execute(
+                "UPDATE tag_rules SET equivalent_to = ? WHERE scope = ? AND version = ?",
+                (version, scope, previous),
+            )
+
+
+def sync_tag_rules(
+    scope: str,
+    tag_columns: tuple[str, ...],
+    batch_fn: Callable[[list], list[list[str]]],
+    snapshot: dict,
+    version: str,
+    allow_full: bool = False,
+) -> dict:
+    """Bring stored tags of scope (papers|posts) up to the current rule set.
+    If only keywords were added/removed within existing tags, re-tag just the rows containing those
+    keywords (found through the trigram index). Other rule changes need a full re-tag: done when
+    allow_full, otherwise reported as pending (run /api/backfill-tags?force=true).
+    Returns {"mode": init|unchanged|incremental|full|pending, "keywords": n, "candidates": n, "updated": n}."""
+    with connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT version, snapshot FROM tag_rules WHERE scope = ? ORDER BY applied_seq DESC LIMIT 1",
+            (scope,),
+        )
+        last = cursor.fetchone()
+    result = {"mode": "unchanged", "keywords": 0, "candidates": 0, "updated": 0}
+    if last is None:
+        mark_tag_rules_applied(scope, version, snapshot)
+        result["mode"] = "init"
+        return result
+    if last["version"] == version:
+        return result
+    changed = diff_tag_rules(json.loads(last["snapshot"]), snapshot)
+    if changed is None:
+        if not allow_full:
+            result["mode"] = "pending"
+            return result
+        result["updated"] = retag_table(scope, tag_columns, batch_fn, version, force=True)
+        mark_tag_rules_applied(scope, version, snapshot)
+        result["mode"] = "full"
+        return result
+    rowids = find_keyword_candidates(scope, changed)
+    result.update(mode="incremental", keywords=len(changed), candidates=len(rowids))
+    if rowids:
+        result["updated"] = retag_table(scope, tag_columns, batch_fn, version, force=True, rowids=rowids)
+    mark_tag_rules_applied(scope, version, snapshot, previous=last["version"])
+    print(
+        f"[retag] {scope}: rules {last['version']} -> {version}, {len(changed)} keywords changed, "
+        f"{len(rowids)} candidate rows, {result['updated']} re-tagged"
+    )
+    return result
@@ -1,6 +1,16 @@
 """Auto-tagging for papers and posts."""
-import re
-from typing import Sequence
+import hashlib
+import json
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterable, Iterator, Sequence, TypeVar
+
+try:
+    import ahocorasick  # pyahocorasick：C 实现的 Aho-Corasick 自动机，未安装时回退到纯 Python 扫描
+except ImportError:
+    ahocorasick = None
 
 # 3DGS 相关关键词：以下标签需同时匹配 3dgs + 该标签关键词，才打标
 THREEDGS_KEYWORDS = ["3d gaussian", "3dgs", "4d gaussian", "4dgs", "4d gaussian splatting", "dynamic gaussian", "gaussian splatting", "neural gaussian"]
@@ -84,6 +94,10 @@ CONFERENCE_TAG_KEYWORDS: dict[str, list[str]] = {
     "SIGGRAPH": ["siggraph"],
 }
 
+# 批量打标：每批行数与进程数（0 = CPU 核数）
+TAG_BATCH_SIZE = max(100, int(os.getenv("TAG_BATCH_SIZE", "2000")))
+TAG_WORKERS = int(os.getenv("TAG_WORKERS", "0")) or (os.cpu_count() or 1)
+
 # 业务标签集合（用于过滤：无业务标签的论文不入库）
 BUSINESS_TAGS = frozenset(PAPER_TAG_KEYWORDS.keys()) | frozenset(CONFERENCE_TAG_KEYWORDS.keys())
 
@@ -96,27 +110,127 @@ COMPANY_DIRECTION_LABELS: dict[str, str] = {
     "embodied": "机器人",
 }
 
+# 标签位注册表：固定小标签集（业务标签、会议标签、来源标签、公司方向标签）各占 tag_mask 的一位。
+# 位号已写入库中，只可追加新标签、不可改号或复用；未登记的标签（频道名、公司名等）仅存于 tags 与关联表
+TAG_BITS: dict[str, int] = {
+    "3DGS": 0,
+    "视频/世界模型": 1,
+    "3DGS物理仿真": 2,
+    "3D重建/生成/渲染": 3,
+    "VR/AR": 4,
+    "可重光照/逆渲染": 5,
+    "3D人体/角色": 6,
+    "3DGS编辑": 7,
+    "3DGS水下建模": 8,
+    "空间智能": 9,
+    "CVPR": 10,
+    "ICCV": 11,
+    "ECCV": 12,
+    "ICLR": 13,
+    "NeurIPS": 14,
+    "SIGGRAPH": 15,
+    "HN": 16,
+    "Reddit": 17,
+    "GitHub": 18,
+    "YouTube": 19,
+    "Hugging Face": 20,
+    "微信公众号": 21,
+    "3D设计": 22,
+    "大模型": 23,
+    "机器人": 24,
+}
 
-def _match_keywords(text: str, tag_keywords: dict[str, list[str]]) -> list[str]:
-    """Match text against tag keywords, return matched tags."""
-    if not text:
-        return []
-    text_lower = text.lower().strip()
-    tags = []
-    for tag, keywords in tag_keywords.items():
-        for kw in keywords:
-            if kw.lower() in text_lower:
-                tags.append(tag)
-                break
-    return list(dict.fromkeys(tags))  # preserve order, dedupe
+# 打标输入字段（顺序即内容哈希与批量打标元组的顺序）
+PAPER_TAG_FIELDS = ("title", "abstract", "categories", "keywords", "source", "venue")
+POST_TAG_FIELDS = ("title", "summary", "source", "channel", "author")
+
+# 打标逻辑修订号：修改 tag_paper/tag_post 等函数逻辑（而非关键词表）时 +1，使已缓存标签失效
+TAG_LOGIC_REVISION = 1
+
+
+class _KeywordMatcher:
+    """Precompiled multi-pattern matcher for one keyword table plus the 3dgs guard.
 
+    All keywords are lowercased once and compiled into a single automaton, so one
+    pass over the text yields every matched tag and whether a 3dgs keyword occurs.
+    Matches are plain substring hits, identical to ``kw.lower() in text.lower()``.
+    """
 
-def _has_3dgs_keyword(text: str) -> bool:
-    """Check if text contains any 3dgs-related keyword."""
-    if not text:
-        return False
-    tl = text.lower()
-    return any(kw.lower() in tl for kw in THREEDGS_KEYWORDS)
+    def __init__(
+        self,
+        tag_keywords: dict[str, list[str]],
+        guard_keywords: Sequence[str],
+        guard_required_tags: frozenset[str],
+    ):
+        self.tags = list(tag_keywords.keys())
+        self.guard_bit = 1 << len(self.tags)
+        self.required_mask = 0
+        for i, tag in enumerate(self.tags):
+            if tag in guard_required_tags:
+                self.required_mask |= 1 << i
+        masks: dict[str, int] = {}
+        for i, kws in enumerate(tag_keywords.values()):
+            for kw in kws:
+                k = kw.lower()
+                masks[k] = masks.get(k, 0) | (1 << i)
+        for kw in guard_keywords:
+            k = kw.lower()
+            masks[k] = masks.get(k, 0) | self.guard_bit
+        # 空关键词与 `"" in text` 一致：恒命中
+        self.always = masks.pop("", 0)
+        self._automaton = None
+        self._patterns: list[tuple[str, int]] = []
+        if ahocorasick is not None:
+            automaton = ahocorasick.Automaton()
+            for k, mask in masks.items():
+                automaton.add_word(k, mask)
+            if masks:
+                automaton.make_automaton()
+                self._automaton = automaton
+        else:
+            # 回退：若短词 j 是 k 的子串且覆盖 k 的全部标签位，k 命中时 j 必命中，可省去 k 的扫描
+            for k, mask in masks.items():
+                if any(j != k and j in k and (m & mask) == mask for j, m in masks.items()):
+                    continue
+                self._patterns.append((k, mask))
+
+    def scan(self, text: str) -> int:
+        """Return the bitmask of matched tags (and guard bit) for already-lowercased text."""
+        found = self.always
+        if self._automaton is not None:
+            for _end, mask in self._automaton.iter(text):
+                found |= mask
+        else:
+            for k, mask in self._patterns:
+                if mask & ~found and k in text:
+                    found |= mask
+        return found
+
+    def match(self, text: str) -> list[str]:
+        """Matched tags in table order, with 3dgs-required tags dropped when no 3dgs keyword occurs."""
+        if not text:
+            return []
+        found = self.scan(text.lower().strip())
+        if not found & self.guard_bit:
+            found &= ~self.required_mask
+        return [tag for i, tag in enumerate(self.tags) if found >> i & 1]
+
+
+# id(关键词表) -> (表, matcher)；保留表的引用，id 不会被复用。按 id 查找，每次打标不再遍历整张表；
+# tag_rules_version 发现某范围的规则指纹变化（关键词表被修改）时清空，按新内容重建
+_MATCHERS: dict[int, tuple[dict, _KeywordMatcher]] = {}
+_RULES_SEEN: dict[str, str] = {}
+
+
+def _get_matcher(tag_keywords: dict[str, list[str]]) -> _KeywordMatcher:
+    """Return the compiled matcher of a keyword table (rebuilt after tag_rules_version sees the rules change)."""
+    entry = _MATCHERS.get(id(tag_keywords))
+    if entry is None:
+        entry = _MATCHERS[id(tag_keywords)] = (
+            tag_keywords,
+            _KeywordMatcher(tag_keywords, THREEDGS_KEYWORDS, THREEDGS_REQUIRED_TAGS),
+        )
+    return entry[1]
 
 
 def tag_paper(
@@ -130,10 +244,8 @@ def tag_paper(
     """Compute tags for a paper from title, abstract, categories, keywords, venue."""
     tags = []
     combined = f"{title or ''} {abstract or ''} {categories or ''} {keywords or ''}"
-    tags.extend(_match_keywords(combined, PAPER_TAG_KEYWORDS))
-    # 3DGS 子标签：需同时包含 3dgs 关键词，否则移除
-    if not _has_3dgs_keyword(combined):
-        tags = [t for t in tags if t not in THREEDGS_REQUIRED_TAGS]
+    # 单次扫描同时得到研究方向标签与 3dgs 约束；3DGS 子标签需同时包含 3dgs 关键词，否则移除
+    tags.extend(_get_matcher(PAPER_TAG_KEYWORDS).match(combined))
     # 会议标签：仅在 categories/venue 中匹配
     cats_venue = f"{categories or ''} {venue or ''}".lower()
     for conf, kws in CONFERENCE_TAG_KEYWORDS.items():
@@ -160,9 +272,7 @@ def tag_post(
     """Compute tags for a community post."""
     tags = []
     combined = f"{title or ''} {summary or ''}"
-    tags.extend(_match_keywords(combined, POST_TAG_KEYWORDS))
-    if not _has_3dgs_keyword(combined):
-        tags = [t for t in tags if t not in THREEDGS_REQUIRED_TAGS]
+    tags.extend(_get_matcher(POST_TAG_KEYWORDS).match(combined))
     if source:
         sl = source.lower()
         if sl == "hn":
@@ -190,9 +300,7 @@ def tag_company_post(
     """Compute tags for a company post. channel=company name."""
     tags = []
     combined = f"{title or ''} {summary or ''}"
-    tags.extend(_match_keywords(combined, POST_TAG_KEYWORDS))
-    if not _has_3dgs_keyword(combined):
-        tags = [t for t in tags if t not in THREEDGS_REQUIRED_TAGS]
+    tags.extend(_get_matcher(POST_TAG_KEYWORDS).match(combined))
     for direction, companies in company_directions.items():
         if channel in companies:
             label = COMPANY_DIRECTION_LABELS.get(direction, direction)
@@ -206,6 +314,108 @@ def tag_company_post(
     return list(dict.fromkeys(tags))
 
 
+def tag_rules_snapshot(scope: str, company_directions: dict[str, list[str]] | None = None) -> dict:
+    """Rule set that determines tags for scope (papers|posts). Key order is kept: tag order affects output."""
+    rules: dict = {"revision": TAG_LOGIC_REVISION}
+    if scope == "papers":
+        rules["keywords"] = PAPER_TAG_KEYWORDS
+        rules["conference"] = CONFERENCE_TAG_KEYWORDS
+    else:
+        rules["keywords"] = POST_TAG_KEYWORDS
+        rules["company_labels"] = COMPANY_DIRECTION_LABELS
+        rules["company_directions"] = company_directions or {}
+    rules["threedgs"] = THREEDGS_KEYWORDS
+    rules["threedgs_required"] = sorted(THREEDGS_REQUIRED_TAGS)
+    return rules
+
+
+def tag_rules_version(scope: str, company_directions: dict[str, list[str]] | None = None) -> str:
+    """Short fingerprint of the rule set for scope. Stored per row as tag_version."""
+    raw = json.dumps(tag_rules_snapshot(scope, company_directions), ensure_ascii=False)
+    version = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+    if _RULES_SEEN.get(scope, version) != version:
+        _MATCHERS.clear()  # 规则已改：抓取与重打标都先取规则版本，之后的打标用新表重建的 matcher
+    _RULES_SEEN[scope] = version
+    return version
+
+
+def diff_tag_rules(old: dict, new: dict) -> set[str] | None:
+    """Lowercased keywords added to or removed from any tag between two rule snapshots.
+    None if anything else changed (tags added/removed/reordered, 3dgs guard, conference table, logic
+    revision, company mapping): such changes can affect rows without the keywords and need a full re-tag."""
+    if list(old) != list(new):
+        return None
+    if any(old[k] != new[k] for k in new if k != "keywords"):
+        return None
+    old_kw, new_kw = old["keywords"], new["keywords"]
+    if list(old_kw) != list(new_kw):
+        return None
+    changed: set[str] = set()
+    for tag, kws in new_kw.items():
+        changed |= {k.lower() for k in old_kw[tag]} ^ {k.lower() for k in kws}
+    return changed
+
+
+def tag_input_hash(values: Iterable[str | None]) -> str:
+    """Hash of the tag-relevant field values (PAPER_TAG_FIELDS / POST_TAG_FIELDS order). Stored per row as tag_hash."""
+    raw = "\x1f".join(str(v) if v is not None else "" for v in values)
+    return hashlib.blake2b(raw.encode("utf-8"), digest_size=8).hexdigest()
+
+
+def tag_papers_batch(rows: Sequence[Sequence[str | None]]) -> list[list[str]]:
+    """Tag a chunk of papers. Each row: (title, abstract, categories, keywords, source, venue)."""
+    return [tag_paper(*(v or "" for v in row)) for row in rows]
+
+
+def tag_posts_batch(
+    rows: Sequence[Sequence[str | None]],
+    company_directions: dict[str, list[str]] | None = None,
+) -> list[list[str]]:
+    """Tag a chunk of posts. Each row: (title, summary, source, channel, author).
+    Company posts use tag_company_post when company_directions is given."""
+    result = []
+    for title, summary, source, channel, author in rows:
+        if source == "company" and company_directions is not None:
+            result.append(tag_company_post(title or "", summary or "", channel or "", author or "", company_directions))
+        else:
+            result.append(tag_post(title or "", summary or "", source or "", channel))
+    return result
+
+
+K = TypeVar("K")
+
+
+def map_tag_batches(
+    fn: Callable[[list], list[list[str]]],
+    batches: Iterable[tuple[K, list]],
+    workers: int = 1,
+) -> Iterator[tuple[K, list[list[str]]]]:
+    """Apply a batch tagging fn to (key, rows) chunks, in order.
+    workers > 1 spreads chunks over a process pool with at most 2 * workers chunks in flight,
+    so memory stays bounded when batches is a streaming generator."""
+    if workers <= 1:
+        for key, rows in batches:
+            yield key, fn(rows)
+        return
+    # spawn：uvicorn 进程内有多线程，fork 不安全；首个批次到达时才启动进程池（全部命中缓存时不启动）
+    ex = None
+    pending = deque()
+    try:
+        for key, rows in batches:
+            if ex is None:
+                ex = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            pending.append((key, ex.submit(fn, rows)))
+            if len(pending) >= workers * 2:
+                k, fut = pending.popleft()
+                yield k, fut.result()
+        while pending:
+            k, fut = pending.popleft()
+            yield k, fut.result()
+    finally:
+        if ex is not None:
+            ex.shutdown(cancel_futures=True)
+
+
 def tags_to_str(tags: Sequence[str]) -> str:
     """Serialize tags list to comma-separated string for DB storage."""
     if not tags:
@@ -213,6 +423,16 @@ def tags_to_str(tags: Sequence[str]) -> str:
     return ",".join(str(t).strip() for t in tags if str(t).strip())
 
 
+def tags_to_mask(tags: Iterable[str]) -> int:
+    """Bitmask of the registered tags among tags (see TAG_BITS). Stored per row as tag_mask."""
+    mask = 0
+    for t in tags:
+        bit = TAG_BITS.get(t)
+        if bit is not None:
+            mask |= 1 << bit
+    return mask
+
+
 def str_to_tags(s: str | None) -> list[str]:
     """Parse tags from comma-separated string."""
     if not s or not s.strip():
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""验证列表接口的查询计划：看板默认查询走索引区间扫描、无临时 B-tree 排序。运行: py verify_query_plans.py"""
+import inspect
+import sys
+
+# (接口, 参数, 是否要求从索引 SEARCH 出发)。按分数排序为索引有序全扫描（LIMIT 提前结束），只检查无排序
+CASES = [
+    ("list_papers", {}, True),
+    ("list_papers", {"days": 7, "conference_days": 90}, True),
+    ("list_papers", {"tag": "3DGS"}, True),
+    ("list_papers", {"source": "openreview"}, True),
+    ("list_papers", {"source": "arxiv", "days": 90}, True),
+    ("list_papers", {"days": 0, "conference_days": 0}, False),
+    ("list_posts", {}, True),
+    ("list_posts", {"tag": "3DGS", "days": 30}, True),
+    ("list_posts", {"sort": "star"}, False),
+]
+
+LIST_TABLES = (" FROM papers p ", " FROM posts p ", " FROM paper_tags pt ", " FROM post_tags pt ")
+
+
+def _call(endpoint, params: dict):
+    """Call an endpoint function directly: FastAPI Query defaults resolved, params overriding."""
+    kwargs = {}
+    for name, p in inspect.signature(endpoint).parameters.items():
+        default = getattr(p.default, "default", p.default)
+        kwargs[name] = params.get(name, default)
+    return endpoint(**kwargs)
+
+
+def main():
+    print("=== 列表查询计划验证 ===\n")
+    import main as app_main
+    from database import connection, init_db
+
+    init_db()
+    failures = 0
+    for name, params, need_search in CASES:
+        statements: list[str] = []
+        with connection() as conn:
+            conn.set_trace_callback(statements.append)
+            try:
+                # 取两页：第二页带游标，覆盖 keyset 条件
+                resp = _call(getattr(app_main, name), {**params, "limit": 20})
+                cursor = resp.headers.get("x-next-cursor")
+                if cursor:
+                    _call(getattr(app_main, name), {**params, "limit": 20, "cursor": cursor})
+            finally:
+                conn.set_trace_callback(None)
+            selects = [s for s in statements if s.lstrip().startswith("SELECT") and any(t in s for t in LIST_TABLES)]
+            for sql in selects:
+                plan = [row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+                problems = [d for d in plan if "TEMP B-TREE" in d]
+                if need_search and not any(d.startswith("SEARCH") for d in plan[:1]):
+                    problems.append(f"driving step is not an index search: {plan[0]}")
+                status = "FAIL" if problems else "OK"
+                failures += bool(problems)
+                print(f"[{status}] {name} {params}")
+                for d in plan:
+                    print(f"    {d}")
+                for p in problems:
+                    print(f"  -> {p}")
+    print(f"\n{'全部通过' if not failures else f'{failures} 条查询计划不符合要求'}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())